@@ -2,10 +2,16 @@ from rdflib import Graph, Namespace, URIRef, Literal, BNode
 from rdflib.namespace import XSD
 from namespaces import NameSpaces
 from uuid import uuid4
+from contextlib import contextmanager
+import hashlib
 import re
 
 np = NameSpaces()
 
+# Scope of the deterministic URIs (see `uri_scope`): path of the resource being created and number of URIs
+# already minted in it for each namespace and prefix
+_uri_scope = None
+
 def get_literal_without_option(value:str):
     """
     Create a Literal object without any language or datatype option.
@@ -151,6 +157,7 @@ def convert_result_elem_to_rdflib_elem(result_elem:dict):
 def generate_uri(namespace:Namespace=None, prefix:str=None):
     """
     Generate a new URIRef based on the provided namespace and an optional prefix.
+    The identifier is random, or derived from the current path inside a `uri_scope` block.
 
     Parameters:
     - namespace (Namespace, optional): The namespace to generate the URIRef from (default is None).
@@ -164,10 +171,46 @@ def generate_uri(namespace:Namespace=None, prefix:str=None):
     uri = generate_uri(np.EX, "example")
     ```
     """
+    uri_id = uuid4().hex if _uri_scope is None else get_scoped_uri_id(namespace, prefix)
     if prefix:
-        return namespace[f"{prefix}_{uuid4().hex}"]
+        return namespace[f"{prefix}_{uri_id}"]
     else:
-        return namespace[uuid4().hex]
+        return namespace[uri_id]
+
+@contextmanager
+def uri_scope(path:str=None):
+    """
+    Make `generate_uri` deterministic inside a block: the n-th URI minted for a namespace and a prefix is identified
+    by a hash of the path, the namespace, the prefix and n, instead of a random UUID.
+    As long as the resources of a path are created in the same order, they get the same URIs from one run to another,
+    whatever the other paths created before, or in other processes. With `path=None`, the URIs stay random.
+
+    Parameters:
+    - path (str, optional): A path identifying the resource being created, e.g. "events/12/1" (default is None).
+
+    Example usage:
+    ```python
+    with uri_scope("events/12/1"):
+        uri = generate_uri(np.FACTOIDS, "EV")
+    ```
+    """
+    global _uri_scope
+    previous_scope = _uri_scope
+    _uri_scope = None if path is None else (path, {})
+    try:
+        yield
+    finally:
+        _uri_scope = previous_scope
+
+def get_scoped_uri_id(namespace:Namespace=None, prefix:str=None):
+    """
+    Deterministic identifier of the next URI of a namespace and a prefix in the current `uri_scope`,
+    with the length of a UUID in hexadecimal format.
+    """
+    path, counts = _uri_scope
+    key = (str(namespace), prefix)
+    counts[key] = counts.get(key, 0) + 1
+    return hashlib.sha256(f"{path}|{key[0]}|{prefix}|{counts[key]}".encode("utf-8")).hexdigest()[:32]
 
 def generate_uuid():
     """
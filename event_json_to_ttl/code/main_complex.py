@@ -4,15 +4,16 @@ import graphdb as gd
 import graphrdf as gr
 import states_events_json as sej
 from rdflib import Graph, URIRef
+import argparse
 import json
 import csv_ground_truth_to_json as cgtj
 
 # 初始化命名空间
 np = NameSpaces()
 
-def create_graph_from_events(events_json_file: str):
+def read_event_descriptions(events_json_file: str):
     """
-    Création d'un graphe à partir du fichier JSON des événements
+    Lecture du fichier JSON des événements (None en cas d'erreur)
     """
     print(f"Traitement du fichier : {events_json_file}")  
     try:
@@ -21,14 +22,36 @@ def create_graph_from_events(events_json_file: str):
             event_descriptions = json.load(file)
     except Exception as e:
         print(f"Erreur lors de la lecture de {events_json_file}: {e}")
-        return Graph()  # Retourne un graphe vide pour éviter l'arrêt du programme
+        return None
     
     print(event_descriptions)
+    return event_descriptions
+
+def create_graph_from_events(events_json_file: str, processes: int = 1,
+                             deterministic_uris: bool = False):
+    """
+    Création d'un graphe à partir du fichier JSON des événements
+    """
+    event_descriptions = read_event_descriptions(events_json_file)
+    if event_descriptions is None:
+        return Graph()  # Retourne un graphe vide pour éviter l'arrêt du programme
     
-    g = sej.create_graph_from_event_descriptions(event_descriptions)
+    g = sej.create_graph_from_event_descriptions(event_descriptions, processes, deterministic_uris)
     np.bind_namespaces(g)
     return g
 
+def write_events_as_ntriples(events_json_file: str, output_file: str, processes: int = 1,
+                             deterministic_uris: bool = False):
+    """
+    Écriture des triplets des événements au format N-Triples (un sous-ensemble de Turtle), sans créer de graphe
+    """
+    event_descriptions = read_event_descriptions(events_json_file)
+    if event_descriptions is None:
+        event_descriptions = {"events": []}
+    sej.write_ntriples_from_event_descriptions(event_descriptions, output_file, processes,
+                                               deterministic_uris=deterministic_uris)
+    print(f"Triplets correctement écrits dans {output_file}")
+
 def serialize_graph(g, output_file):
     """
     Sérialiser le graphe au format Turtle
@@ -43,6 +66,15 @@ def serialize_graph(g, output_file):
 
 if __name__ == '__main__': 
 
+    parser = argparse.ArgumentParser(description="Création du graphe des événements du ground truth, import dans GraphDB et création du ground truth JSON")
+    parser.add_argument('--ntriples', action='store_true',
+                        help="write the events as N-Triples (imported as Turtle by GraphDB) from a buffer of triples, without building a graph nor serializing it, much faster")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="number of worker processes converting the events")
+    parser.add_argument('--deterministic_uris', action='store_true',
+                        help="derive the URIs of each event from its id instead of random UUIDs, so that the output does not change from one run to another")
+    args = parser.parse_args()
+
     # Code principal
     data_json_folder = "../data/json/"
     data_folder = "../data/"
@@ -56,9 +88,13 @@ if __name__ == '__main__':
     df = cgtj.read_csv(csv_ground_truth, separator='\t')
     cgtj.create_event_descriptions(df, json_ground_truth)
 
-    g = create_graph_from_events(json_ground_truth)
-    np.bind_namespaces(g)
-    g.serialize(events_ttl_file)
+    if args.ntriples:
+        events_ttl_file = data_json_folder + "events_complex.nt"
+        write_events_as_ntriples(json_ground_truth, events_ttl_file, args.processes, args.deterministic_uris)
+    else:
+        g = create_graph_from_events(json_ground_truth, args.processes, args.deterministic_uris)
+        np.bind_namespaces(g)
+        g.serialize(events_ttl_file)
 
     ##### Partie commentée pour la création du graphe à partir des fichiers JSON des événements #####
 
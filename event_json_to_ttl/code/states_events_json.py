@@ -1,4 +1,8 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
 from rdflib import Graph, Literal, URIRef
+from rdflib.term import Node
 from namespaces import NameSpaces, OntologyMapping
 import time_processing as tp
 import graphrdf as gr
@@ -7,6 +11,75 @@ import resource_initialisation as ri
 np = NameSpaces()
 om = OntologyMapping()
 
+# Escapes of the characters which cannot appear as is in an N-Triples literal
+NT_LITERAL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"})
+
+############################################################ Bulk triple buffer ############################################################
+
+class TripleBuffer:
+    """
+    Stand-in for an rdflib Graph in the creation functions (which only call `add`): triples are appended to a flat
+    list instead of being indexed one by one by the graph store.
+    The buffer is written directly as N-Triples, which is much faster than building a graph and serializing it,
+    or loaded into a Graph (e.g. to merge the triples of parallel workers): loading it is not faster than `add`,
+    since the default store adds the triples one by one.
+    """
+
+    def __init__(self):
+        self.triples = []
+
+    def __len__(self):
+        return len(self.triples)
+
+    def add(self, triple):
+        s, p, o = triple
+        # same checks as Graph.add, so that an invalid triple fails where it is created
+        assert isinstance(s, Node), "Subject %s must be an rdflib term" % (s,)
+        assert isinstance(p, Node), "Predicate %s must be an rdflib term" % (p,)
+        assert isinstance(o, Node), "Object %s must be an rdflib term" % (o,)
+        self.triples.append(triple)
+
+    def to_graph(self, g:Graph=None):
+        """
+        Load the triples into a graph (a new one by default) with a single `addN`
+        """
+        g = Graph() if g is None else g
+        g.addN((s, p, o, g) for s, p, o in self.triples)
+        return g
+
+    def serialize_ntriples(self, destination:str):
+        """
+        Write the triples as N-Triples without building a graph, each triple once
+        """
+        with open(destination, "w", encoding="utf-8") as file:
+            write_unique_rows(file, self.get_ntriples_rows(), set())
+
+    def get_ntriples_rows(self):
+        return [" ".join(get_ntriples_term(term) for term in triple) + " .\n" for triple in self.triples]
+
+def get_ntriples_term(term:Node):
+    """
+    N-Triples form of a term. The N3 form of a literal is not used since it is written between triple quotes
+    when it contains a newline, which N-Triples does not allow.
+    """
+    if not isinstance(term, Literal):
+        return term.n3()
+    literal = f'"{str(term).translate(NT_LITERAL_ESCAPES)}"'
+    if term.language is not None:
+        return f"{literal}@{term.language}"
+    if term.datatype is not None:
+        return f"{literal}^^<{term.datatype}>"
+    return literal
+
+def write_unique_rows(file, rows:list[str], written:set):
+    """
+    Write the rows which are not in `written` yet (and add them to it)
+    """
+    for row in rows:
+        if row not in written:
+            written.add(row)
+            file.write(row)
+
 ############################################################ Functions for event and version creation ############################################################
 
 def get_provenance_uri(provenance_description:dict):
@@ -103,19 +176,138 @@ def create_publisher_from_description(g:Graph, description:dict, lang:str=None):
 
 ############################################################ Event creation ####################################################################
 
-def create_graph_from_event_descriptions(descriptions:list[dict]):
+def create_graph_from_event_descriptions(descriptions:list[dict], processes:int=1, deterministic_uris:bool=False):
+    """
+    Generate the graph of a set of event descriptions.
+    With several `processes`, the events are converted in parallel (see `create_triples_from_event_descriptions`).
+    With `deterministic_uris`, the URIs of each event are derived from its id (see `get_event_paths`)
+    instead of being random, so that two runs on the same descriptions give the same graph.
+    """
+    if processes > 1:
+        buffer = create_triples_from_event_descriptions(descriptions, processes, deterministic_uris=deterministic_uris)
+        return buffer.to_graph()
+
+    g = Graph()
+    add_event_descriptions(g, descriptions, deterministic_uris)
+    return g
+
+def create_triples_from_event_descriptions(descriptions:list[dict], processes:int=1, chunk_size:int=None,
+                                           deterministic_uris:bool=False):
+    """
+    Generate the triples of a set of event descriptions in a TripleBuffer
+    (e.g. to write them with `serialize_ntriples` without building a graph).
+    With several `processes`, the events are split into chunks of `chunk_size` events (by default, 4 chunks per
+    process) converted in worker processes, and the triples of the chunks are concatenated in the order of the events.
+    With `deterministic_uris`, the parallel conversion gives the same triples as the serial one.
+    """
+    buffer = TripleBuffer()
+    if processes <= 1:
+        add_event_descriptions(buffer, descriptions, deterministic_uris)
+        return buffer
+
+    source_uri = add_source_description(buffer, descriptions, deterministic_uris)
+    for triples in map_event_chunks(create_triples_from_event_chunk, descriptions, source_uri, processes, chunk_size,
+                                    deterministic_uris):
+        buffer.triples += triples
+
+    return buffer
+
+def write_ntriples_from_event_descriptions(descriptions:list[dict], destination:str, processes:int=1,
+                                           chunk_size:int=None, deterministic_uris:bool=False):
+    """
+    Write the triples of a set of event descriptions as N-Triples, each triple once.
+    With several `processes`, the worker processes send back N-Triples rows, which are much cheaper to transfer
+    than rdflib terms, and the rows of the chunks are written in the order of the events.
+    With `deterministic_uris`, the file is the same whatever the number of processes.
+    """
+    if processes <= 1:
+        buffer = create_triples_from_event_descriptions(descriptions, deterministic_uris=deterministic_uris)
+        buffer.serialize_ntriples(destination)
+        return
+
+    buffer = TripleBuffer()
+    source_uri = add_source_description(buffer, descriptions, deterministic_uris)
+    written = set()
+    with open(destination, "w", encoding="utf-8") as file:
+        write_unique_rows(file, buffer.get_ntriples_rows(), written)
+        for rows in map_event_chunks(create_ntriples_from_event_chunk, descriptions, source_uri, processes, chunk_size,
+                                     deterministic_uris):
+            write_unique_rows(file, rows, written)
+
+def map_event_chunks(worker, descriptions:list[dict], source_uri:URIRef, processes:int, chunk_size:int=None,
+                     deterministic_uris:bool=False):
+    """
+    Split the events into chunks of `chunk_size` events (by default, 4 chunks per process) and yield the results of
+    `worker` on each chunk, computed in `processes` worker processes, in the order of the events
+    """
     events_desc = descriptions.get("events")
+    scoped_events = list(zip(get_event_paths(events_desc, deterministic_uris), events_desc))
+    chunk_size = chunk_size or max(1, -(-len(scoped_events) // (4 * processes)))
+    chunks = [(scoped_events[i:i+chunk_size], source_uri) for i in range(0, len(scoped_events), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        yield from pool.map(worker, chunks)
+
+def create_triples_from_event_chunk(chunk:tuple):
+    """
+    Worker of the parallel conversion: triples of a chunk of (path, description) events
+    """
+    scoped_events, source_uri = chunk
+    buffer = TripleBuffer()
+    add_events(buffer, scoped_events, source_uri)
+    return buffer.triples
+
+def create_ntriples_from_event_chunk(chunk:tuple):
+    """
+    Worker of the parallel conversion: N-Triples rows of a chunk of (path, description) events
+    """
+    scoped_events, source_uri = chunk
+    buffer = TripleBuffer()
+    add_events(buffer, scoped_events, source_uri)
+    return buffer.get_ntriples_rows()
+
+def add_event_descriptions(g:Graph, descriptions:list[dict], deterministic_uris:bool=False):
+    events_desc = descriptions.get("events")
+    source_uri = add_source_description(g, descriptions, deterministic_uris)
+    add_events(g, zip(get_event_paths(events_desc, deterministic_uris), events_desc), source_uri)
+
+def add_source_description(g:Graph, descriptions:list[dict], deterministic_uris:bool=False):
     source_desc = descriptions.get("source")
-    g = Graph()
 
     source_uri = None
     if isinstance(source_desc, dict):
-        source_uri = create_source_from_description(g, source_desc)
+        with gr.uri_scope("source" if deterministic_uris else None):
+            source_uri = create_source_from_description(g, source_desc)
 
-    for desc in events_desc:
-        create_graph_from_event_description(g, desc, source_uri)
+    return source_uri
 
-    return g
+def add_events(g:Graph, scoped_events, source_uri:URIRef=None):
+    """
+    Add (path, description) events, whose URIs are minted in the scope of their path (random when it is None)
+    """
+    for path, desc in scoped_events:
+        with gr.uri_scope(path):
+            create_graph_from_event_description(g, desc, source_uri)
+
+def get_event_paths(events_desc:list[dict], deterministic_uris:bool=False):
+    """
+    Path of each event, in the scope of which its URIs are minted (see `gr.uri_scope`), or None for random URIs.
+    The path is made of the id of the event, e.g. "events/12", or of a hash of its description when it has no id,
+    so that it does not change when other events are added or removed. Events with the same id are told apart
+    by their rank among them, e.g. "events/12/2" for the second event with the id 12.
+    """
+    if not deterministic_uris:
+        return [None] * len(events_desc)
+
+    paths = []
+    counts = {}
+    for desc in events_desc:
+        event_id = desc.get("id")
+        if event_id is None:
+            event_json = json.dumps(desc, sort_keys=True, ensure_ascii=False)
+            event_id = "#" + hashlib.sha256(event_json.encode("utf-8")).hexdigest()[:16]
+        counts[event_id] = counts.get(event_id, 0) + 1
+        paths.append(f"events/{event_id}" if counts[event_id] == 1 else f"events/{event_id}/{counts[event_id]}")
+    return paths
 
 def create_graph_from_event_description(g:Graph, event_description:dict, source_uri:URIRef=None):
     """
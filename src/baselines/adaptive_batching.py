@@ -0,0 +1,92 @@
+import json
+import os
+from typing import Dict, List
+
+
+def get_size_ladder(max_size: int, min_size: int = 1) -> List[int]:
+    """
+    Batch sizes tried by AdaptiveBatchSize: the powers of two between min_size and max_size, and max_size,
+    e.g. 1, 2, 4, 8, 16, 20
+    """
+    sizes = []
+    size = min_size
+    while size < max_size:
+        sizes.append(size)
+        size *= 2
+    sizes.append(max_size)
+    return sizes
+
+
+class AdaptiveBatchSize:
+    """
+    Number of test sentences per request for one model, learned from the success rate observed at each batch size
+    (an exponentially weighted average of the requests whose answer had every id of the batch).
+    The size moves on a ladder of sizes: it steps down when the success rate of the current size falls below
+    target_success, and steps up after grow_after successes in a row, as long as the success rate of the next size
+    is above the target. Sizes never tried count as successful; a size left for its low success rate is given a
+    little credit at each step-up attempt, so that it is tried again after a while.
+    """
+
+    def __init__(self, max_size: int, min_size: int = 1, target_success: float = 0.8, grow_after: int = 3,
+                 alpha: float = 0.2, rates: Dict[int, float] = None):
+        self.sizes = get_size_ladder(max_size, min_size)
+        self.target_success = target_success
+        self.grow_after = grow_after
+        self.alpha = alpha
+        self.rates = dict(rates or {})
+        self.streak = 0
+        # start at the largest size whose success rate is above the target
+        self.level = max([level for level, size in enumerate(self.sizes) if self.get_rate(size) >= target_success],
+                         default=0)
+
+    def get(self) -> int:
+        return self.sizes[self.level]
+
+    def get_rate(self, size: int) -> float:
+        return self.rates.get(size, 1.0)
+
+    def record(self, size: int, success: bool) -> None:
+        """
+        Record whether a request of `size` sentences got the answers of all of them.
+        """
+        self.rates[size] = (1 - self.alpha) * self.get_rate(size) + self.alpha * success
+        if size < self.get():
+            # smaller batches (end of the input, split batches) do not tell anything about the current size
+            return
+        if not success:
+            self.streak = 0
+            if self.rates[size] < self.target_success and self.level > 0:
+                self.level -= 1
+            return
+        self.streak += 1
+        if self.streak >= self.grow_after and self.level + 1 < len(self.sizes):
+            self.streak = 0
+            next_size = self.sizes[self.level + 1]
+            if self.get_rate(next_size) >= self.target_success:
+                self.level += 1
+            else:
+                self.rates[next_size] = self.get_rate(next_size) + self.alpha * (1 - self.get_rate(next_size))
+
+
+def load_batch_sizes(path: str, model_key: str, max_size: int, **kwargs) -> AdaptiveBatchSize:
+    """
+    Batch size of a model, starting from the success rates saved by a previous run in the state file at path.
+    """
+    rates = {}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as in_file:
+            rates = {int(size): rate for size, rate in json.load(in_file).get(model_key, {}).items()}
+    return AdaptiveBatchSize(max_size, rates=rates, **kwargs)
+
+
+def save_batch_sizes(path: str, model_key: str, batch_size: AdaptiveBatchSize) -> None:
+    """
+    Save the success rates of a model in the state file, which holds the rates of every model.
+    """
+    state = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as in_file:
+            state = json.load(in_file)
+    state[model_key] = {str(size): rate for size, rate in sorted(batch_size.rates.items())}
+    with open(path, "w", encoding="utf-8") as out_file:
+        json.dump(state, out_file, indent=2, ensure_ascii=False)
@@ -0,0 +1,147 @@
+import argparse
+import glob
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of the test sentence ids whose LLM response has been written, with the shard file and the
+    byte offset of the response line. On restart, the ids of the journal are skipped.
+    Lines are buffered and made durable in batches by commit(), which first fsyncs the shard files and then the
+    journal (the shard files closed since the last commit have been synced by their writer): a journaled response
+    is always on disk, while a response written after the last commit is only requested again (and deduplicated
+    at compaction).
+    """
+
+    def __init__(self, journal_path: str, commit_every: int = 100):
+        self.journal_path = journal_path
+        self.commit_every = commit_every
+        # id -> (shard file, offset) of its latest response
+        self.completed = {}
+        self.pending = 0
+        if os.path.exists(journal_path):
+            self.completed = load_journal(journal_path)
+        self.journal_file = open(journal_path, "a", encoding="utf-8")
+        self.shard_files = set()
+
+    def __contains__(self, sent_id) -> bool:
+        return sent_id in self.completed
+
+    def __len__(self) -> int:
+        return len(self.completed)
+
+    def add(self, sent_id, shard_file, offset: int) -> None:
+        """
+        Record the response of a test sentence, written at offset in the open shard_file.
+        """
+        self.completed[sent_id] = (shard_file.name, offset)
+        self.shard_files.add(shard_file)
+        self.journal_file.write(json.dumps({"id": sent_id, "file": shard_file.name, "offset": offset},
+                                           ensure_ascii=False) + "\n")
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self) -> None:
+        for shard_file in self.shard_files:
+            if not shard_file.closed:
+                shard_file.flush()
+                os.fsync(shard_file.fileno())
+        self.shard_files = {shard_file for shard_file in self.shard_files if not shard_file.closed}
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.journal_file.close()
+
+
+def load_journal(journal_path: str) -> Dict:
+    """
+    Read a journal: id -> (shard file, offset) of its latest response. A truncated last line, left by a crash
+    during a write, is ignored.
+    """
+    completed = {}
+    with open(journal_path, "r", encoding="utf-8") as journal_file:
+        for line in journal_file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            completed[entry["id"]] = (entry["file"], entry["offset"])
+    return completed
+
+
+def read_response(shard_path: str, offset: int, shard_files: Dict) -> Optional[Dict]:
+    """
+    Read the response line at offset in a shard file, keeping the shard files open in shard_files.
+    """
+    if shard_path not in shard_files:
+        shard_files[shard_path] = open(shard_path, "rb")
+    shard_file = shard_files[shard_path]
+    shard_file.seek(offset)
+    try:
+        return json.loads(shard_file.readline())
+    except json.JSONDecodeError:
+        return None
+
+
+def get_street(test_path: str) -> str:
+    """
+    Street of a test file, e.g. test/rue_mizon_test.jsonl -> rue_mizon
+    """
+    name = os.path.basename(test_path)
+    return name[:-len("_test.jsonl")] if name.endswith("_test.jsonl") else os.path.splitext(name)[0]
+
+
+def compact(journal_path: str, test_files: Iterable[str], output_dir: str) -> List[Tuple[str, int, int]]:
+    """
+    Merge the shards of a run into one response file per street, e.g. llm_responses/rue_mizon_test_llm_responses.jsonl
+    as consumed by run_eval: the latest response of each id of the street's test file, in the order of the test file.
+    :return: the (output file, number of responses, number of test sentences without response) of each street
+    """
+    completed = load_journal(journal_path)
+    shard_files = {}
+    summary = []
+    try:
+        for test_path in test_files:
+            output_path = os.path.join(output_dir, f"{get_street(test_path)}_test_llm_responses.jsonl")
+            written, missing = 0, 0
+            seen = set()
+            with open(test_path, "r", encoding="utf-8") as test_file, \
+                    open(output_path, "w", encoding="utf-8") as out_file:
+                for line in test_file:
+                    if not line.strip():
+                        continue
+                    sent_id = json.loads(line)["id"]
+                    if sent_id in seen:
+                        continue
+                    seen.add(sent_id)
+                    response = read_response(*completed[sent_id], shard_files) if sent_id in completed else None
+                    if response is None:
+                        missing += 1
+                        continue
+                    out_file.write(json.dumps(response, ensure_ascii=False) + "\n")
+                    written += 1
+            summary.append((output_path, written, missing))
+    finally:
+        for shard_file in shard_files.values():
+            shard_file.close()
+    return summary
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge the shards of an LLM run into per-street response files")
+    parser.add_argument('--journal', type=str, required=True)
+    parser.add_argument('--test_files', type=str, nargs='+', required=True,
+                        help="test files of the streets, e.g. test/*_test.jsonl")
+    parser.add_argument('--output_dir', type=str, default="llm_responses")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.test_files for path in glob.glob(pattern)})
+    for output_path, written, missing in compact(args.journal, paths, args.output_dir):
+        print(f"☑️ {output_path}: {written} responses, {missing} missing")
@@ -0,0 +1,197 @@
+import argparse
+import glob
+import json
+import os
+import zlib
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+# Version of the index file layout: bump it whenever the vectors change, so that old index files are rebuilt.
+INDEX_VERSION = "1"
+
+
+def char_ngrams(text: str, ngram_range: Tuple[int, int] = (3, 5)) -> Iterable[str]:
+    """
+    Character n-grams of a lowercased text, padded with spaces so that word boundaries are captured.
+    """
+    text = f" {' '.join(text.lower().split())} "
+    min_n, max_n = ngram_range
+    for n in range(min_n, max_n + 1):
+        for i in range(len(text) - n + 1):
+            yield text[i:i + n]
+
+
+def hash_counts(text: str, n_features: int, ngram_range: Tuple[int, int]) -> Counter:
+    """
+    Count the character n-grams of a text in n_features buckets. crc32 is used instead of hash(),
+    which is salted per process, so that the persisted vectors stay valid across runs.
+    """
+    return Counter(zlib.crc32(ngram.encode("utf-8")) % n_features for ngram in char_ngrams(text, ngram_range))
+
+
+def get_sources_fingerprint(paths: List[str]) -> List:
+    """
+    Path, size and modification time of each source file, used to detect that a persisted index is outdated.
+    """
+    return [[path, os.path.getsize(path), os.path.getmtime(path)] for path in paths]
+
+
+def load_examples(paths: List[str]) -> List[dict]:
+    """
+    Load the train examples (json objects with an 'id' and a 'sent') of several .jsonl files.
+    When an id appears several times, the first example is kept.
+    """
+    examples = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                example = json.loads(line)
+                examples.setdefault(example['id'], example)
+    return list(examples.values())
+
+
+class ExampleRetriever:
+    """
+    In-process k-nearest neighbour search of few-shot examples. Sentences are embedded on the CPU as TF-IDF
+    weighted character n-gram hashing vectors, L2-normalized and stacked in a NumPy matrix, so that the cosine
+    similarities of a batch of test sentences with all the train examples are a single matrix product.
+    """
+
+    def __init__(self, examples: List[dict], n_features: int = 4096, ngram_range: Tuple[int, int] = (3, 5),
+                 sources: List = None):
+        self.examples = examples
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.sources = sources or []
+        self.version = INDEX_VERSION
+        self.idf = np.ones(n_features, dtype=np.float32)
+        self.matrix = np.zeros((len(examples), n_features), dtype=np.float32)
+        if examples:
+            counts = self.count_matrix([example['sent'] for example in examples])
+            doc_freq = (counts > 0).sum(axis=0)
+            self.idf = (np.log((1 + len(examples)) / (1 + doc_freq)) + 1).astype(np.float32)
+            self.matrix = self.weight(counts)
+
+    def count_matrix(self, sentences: List[str]) -> np.ndarray:
+        counts = np.zeros((len(sentences), self.n_features), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            for bucket, count in hash_counts(sentence, self.n_features, self.ngram_range).items():
+                counts[i, bucket] = count
+        return counts
+
+    def weight(self, counts: np.ndarray) -> np.ndarray:
+        """
+        Sublinear TF-IDF weighting and L2 normalization of a count matrix.
+        """
+        vectors = np.log1p(counts) * self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def embed(self, sentences: List[str]) -> np.ndarray:
+        return self.weight(self.count_matrix(sentences))
+
+    def search(self, sentences: List[str], k: int, batch_size: int = 1024) -> List[List[Tuple[int, float]]]:
+        """
+        Find the k most similar train examples of each sentence.
+        :param sentences: the query sentences
+        :param k: number of neighbours per sentence
+        :param batch_size: number of sentences whose similarities are computed at once
+        :return: for each sentence, the (example position, cosine similarity) pairs by decreasing similarity
+        """
+        k = min(k, len(self.examples))
+        if k == 0:
+            return [[] for _ in sentences]
+        results = []
+        for start in range(0, len(sentences), batch_size):
+            scores = self.embed(sentences[start:start + batch_size]) @ self.matrix.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            # stable sort, so that ties are broken by example position
+            order = np.lexsort((top, -top_scores), axis=1)
+            for row_top, row_scores, row_order in zip(top, top_scores, order):
+                results.append([(int(row_top[j]), float(row_scores[j])) for j in row_order])
+        return results
+
+    def get_examples(self, test_sentences: List[dict], k: int, batch_size: int = 1024) -> List[List[dict]]:
+        """
+        Pick the k most similar train examples of each test sentence, leaving out the train example with the
+        same id as the test sentence, if any.
+        :param test_sentences: json objects with an 'id' and a 'sent'
+        :return: for each test sentence, the list of its examples, the most similar first
+        """
+        neighbours = self.search([sent['sent'] for sent in test_sentences], k + 1, batch_size)
+        selected = []
+        for test_sentence, test_neighbours in zip(test_sentences, neighbours):
+            examples = [self.examples[i] for i, _ in test_neighbours if self.examples[i]['id'] != test_sentence['id']]
+            selected.append(examples[:k])
+        return selected
+
+    def save(self, index_path: str) -> None:
+        meta = {"version": INDEX_VERSION, "n_features": self.n_features, "ngram_range": list(self.ngram_range),
+                "sources": self.sources, "examples": self.examples}
+        with open(index_path, "wb") as out_file:
+            np.savez(out_file, matrix=self.matrix, idf=self.idf, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, index_path: str) -> "ExampleRetriever":
+        with np.load(index_path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            retriever = cls.__new__(cls)
+            retriever.examples = meta["examples"]
+            retriever.n_features = meta["n_features"]
+            retriever.ngram_range = tuple(meta["ngram_range"])
+            retriever.sources = meta["sources"]
+            retriever.idf = data["idf"]
+            retriever.matrix = data["matrix"]
+        retriever.version = meta["version"]
+        return retriever
+
+    @classmethod
+    def from_sources(cls, source_patterns: List[str], index_path: str = None, n_features: int = 4096,
+                     ngram_range: Tuple[int, int] = (3, 5)) -> "ExampleRetriever":
+        """
+        Build the index of the train examples of the files matching the glob patterns, e.g. train/*_train.jsonl.
+        With an index_path, the index is loaded from it when it was built from the same files with the same
+        parameters, and saved to it otherwise.
+        """
+        paths = sorted({path for pattern in source_patterns for path in glob.glob(pattern)})
+        sources = get_sources_fingerprint(paths)
+        if index_path and os.path.exists(index_path):
+            retriever = cls.load(index_path)
+            if retriever.version == INDEX_VERSION and retriever.sources == sources and \
+                    retriever.n_features == n_features and retriever.ngram_range == tuple(ngram_range):
+                return retriever
+
+        retriever = cls(load_examples(paths), n_features, ngram_range, sources)
+        if index_path:
+            retriever.save(index_path)
+        return retriever
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the few-shot example index and query it")
+    parser.add_argument('--sources', type=str, nargs='+', required=True,
+                        help="glob patterns of the train .jsonl files, "
+                             "e.g. ../../train/*_train.jsonl ../../event_json_to_ttl/data/new_train.jsonl")
+    parser.add_argument('--index_path', type=str, required=True)
+    parser.add_argument('--n_features', type=int, default=4096)
+    parser.add_argument('--test_file', type=str, default=None,
+                        help="optional .jsonl file of test sentences whose nearest examples are printed")
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    example_retriever = ExampleRetriever.from_sources(args.sources, args.index_path, args.n_features)
+    print(f"{len(example_retriever.examples)} examples indexed in {args.index_path}")
+    if args.test_file:
+        with open(args.test_file, "r", encoding="utf-8") as f:
+            test_sentences = [json.loads(line) for line in f if line.strip()]
+        for test_sentence, examples in zip(test_sentences, example_retriever.get_examples(test_sentences, args.k)):
+            print(json.dumps({'id': test_sentence['id'], 'examples': [ex['id'] for ex in examples]},
+                             ensure_ascii=False))
@@ -1,79 +1,96 @@
 import json
 import argparse
-from typing import List
-
-
-def get_ontology_concepts(ontology):
+import hashlib
+import itertools
+import math
+import os
+import re
+import sys
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+# The ontology index is shared with the evaluation scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluation"))
+from ontology_index import OntologyIndex
+from example_retriever import ExampleRetriever
+
+# Average number of characters per token, used to estimate the length of the prompts in tokens.
+CHARS_PER_TOKEN = 4
+
+# Number of test sentences whose few-shot examples are retrieved at once.
+RETRIEVAL_BATCH_SIZE = 1024
+
+# Text around the few-shot examples and the test sentences of the packed prompts, as in the Gemini notebook.
+PACKED_EXAMPLES_HEADER = "\n\nExemples :\n"
+PACKED_SENTENCES_HEADER = "\n\n"
+PACKED_PROMPT_CLOSING = ("\nGénère pour chaque phrase un objet JSON sur une ligne, au format JSONL (une ligne par objet "
+                         "JSON, pas de liste, pas de crochets).\n")
+
+# Part suffix of the sharded files, e.g. ont_1_movie_prompts_part1_.jsonl
+SHARD_SUFFIX_PATTERN = re.compile(r"_part\d+_$")
+
+
+@lru_cache(maxsize=None)
+def get_ontology_prompt(ontology: OntologyIndex) -> str:
     """
-    Generate a verbalized list of concepts in the given ontology to be included in the prompt
-    :param ontology: an ontology as a dictionary
-    :return: A string for ontology concepts.
-             e.g. human, city, country, film, film genre....
+    Generate the instructions and the ontology context shared by all the prompts of an ontology.
+    It is built once per ontology and reused for every test sentence.
+    :param ontology: the index of an ontology
+    :return: the beginning of the prompts, up to the ontology relations
     """
-    ont_concepts = ""
-    for onto in ontology['concepts']:
-        ont_concepts += onto['label'] + ", "
-    return ont_concepts[0:-1]
+    prompt_fixed = '''Given the following ontology and sentences, please extract the triples from the sentence according 
+    to the relations in the ontology. In the output, only include the triples in the given output format. \n
+'''
 
+    prompt = prompt_fixed
+    prompt += 'CONTEXT:\n\n'
+    prompt += 'Ontology Concepts: '
+    prompt += ontology.verbalized_concepts
+    prompt += '\nOntology Relations: '
+    prompt += ontology.verbalized_relations
+    return prompt
 
-def get_concept_label(ontology, concept):
+
+def estimate_tokens(text: str) -> int:
     """
-    Get the label for the ontology concept
-    :param ontology: ontology with concepts ids and labels
-    :param ont_dom: input concept ID
-    :return: the label of the input concept
+    Estimate the number of tokens of a text from its number of characters.
     """
-    for onto in ontology['concepts']:
-        if onto['qid'] == concept:
-            return onto['label']
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
 
 
-def get_ontology_relations(ontology):
+class PromptTemplate:
     """
-    Generate a verbalized list of relations in the given ontology to be included in the prompt
-    :param ontology:  an ontology as a dictionary
-    :return: A string for ontology relations.
-            e.g. cast_member(film,human), director (film,human), screenwriter(film,human), producer(film,human), ...
+    Compiled prompt template of an ontology. Every prompt of the ontology starts with the same prefix
+    (instructions, concepts and relations) and only the suffix (example and test sentence) differs.
+    The prefix is identified by a hash of its content, so that the prompts can be written as (prefix_id, suffix)
+    pairs and an LLM client can reuse a cached prefix.
     """
 
-    ont_rels = ""
-    onto_rel_strings = list()
-    for onto in ontology['relations']:
-        ont_rel = onto['label']
-        ont_rel = ont_rel.replace(" ", "_")
-        ont_dom = onto['domain']
-        ont_range = onto['range']
-        ont_domain = get_concept_label(ontology, ont_dom)
-        ont_range = get_concept_label(ontology, ont_range)
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.prefix_id = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+        self.prefix_bytes = len(prefix.encode("utf-8"))
+        self.prefix_tokens = estimate_tokens(prefix)
 
-        if ont_rel == None:
-            continue
-        if ont_domain == None:
-            ont_domain = ""
-        if ont_range == None:
-            ont_range = ""
+    def get_suffix(self, test_sentence: str, train_sents: List[dict]) -> str:
+        return "".join([get_example_prompt(train_sent) for train_sent in train_sents]) + get_test_prompt(test_sentence)
 
-        onto_rel_strings.append(f"{ont_rel} ({ont_domain},{ont_range})\n")
+    def render(self, suffix: str) -> str:
+        return self.prefix + suffix
 
-        ont_rels += ont_rel + "(" + ont_domain + "," + ont_range + "), "
+    def get_prefix_record(self) -> dict:
+        return {'prefix_id': self.prefix_id, 'prefix': self.prefix, 'prefix_bytes': self.prefix_bytes,
+                'prefix_tokens': self.prefix_tokens}
 
-    return ont_rels[0:-2]
 
+@lru_cache(maxsize=None)
+def compile_prompt_template(ontology: OntologyIndex) -> PromptTemplate:
+    return PromptTemplate(get_ontology_prompt(ontology))
 
-def prepare_prompt(ontology: dict, test_sentence: str, train_sent: str) -> str:
 
+def prepare_prompt(ontology: OntologyIndex, test_sentence: str, train_sent: str) -> str:
 
-    prompt_fixed = '''Given the following ontology and sentences, please extract the triples from the sentence according 
-    to the relations in the ontology. In the output, only include the triples in the given output format. \n
-'''
-
-    prompt = prompt_fixed
-    prompt += 'CONTEXT:\n\n'
-    prompt += 'Ontology Concepts: '
-    ont_concepts = get_ontology_concepts(ontology)
-    prompt += ont_concepts
-    prompt += '\nOntology Relations: '
-    prompt += get_ontology_relations(ontology)
+    prompt = get_ontology_prompt(ontology)
     prompt += get_example_prompt(train_sent)
     prompt += get_test_prompt(test_sentence)
 
@@ -91,19 +108,92 @@ def load_jsonl(src_file):
     return data
 
 
-def save_jsonl(data: List, jsonl_path: str):
+def iter_jsonl(src_file) -> Iterator[dict]:
+    """
+    Read a .jsonl file one line at a time.
+    """
+    with open(src_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def save_jsonl(data: Iterable, jsonl_path: str):
     with open(jsonl_path, "w") as out_file:
         for item in data:
             out_file.write(f"{json.dumps(item)}\n")
 
 
-def get_similar_sentences(test_sentence_id, test_similar):
-    for sim in test_similar:
-        if sim == test_sentence_id:
-            return test_similar[sim]
+def get_shard_path(jsonl_path: str, part: int) -> str:
+    """
+    Path of a part file of a sharded .jsonl file, following the naming of the LLM response parts
+    e.g. ont_1_movie_prompts.jsonl -> ont_1_movie_prompts_part1_.jsonl
+    """
+    base, ext = os.path.splitext(jsonl_path)
+    return f"{base}_part{part}_{ext}"
+
+
+def get_prefix_path(jsonl_path: str) -> str:
+    """
+    Path of the file with the prompt prefixes of a prompt file written in template format (shared by its parts)
+    e.g. ont_1_movie_prompts_part1_.jsonl -> ont_1_movie_prompts_prefix.jsonl
+    """
+    base, ext = os.path.splitext(jsonl_path)
+    return f"{SHARD_SUFFIX_PATTERN.sub('', base)}_prefix{ext}"
+
+
+def save_jsonl_shards(data: Iterable, jsonl_path: str, shard_size: int = None, header: dict = None) -> List[str]:
+    """
+    Write json objects to a .jsonl file as they come, or to part files of at most shard_size lines each.
+    :param data: json objects, typically from a generator
+    :param jsonl_path: the output file, from which the part file names are derived
+    :param shard_size: maximum number of lines per part file; a single file is written when it is not given
+    :param header: optional json object written at the beginning of each file
+    :return: the list of the written files
+    """
+    if not shard_size:
+        save_jsonl(itertools.chain([header] if header else [], data), jsonl_path)
+        return [jsonl_path]
+
+    written_paths = []
+    out_file = None
+    try:
+        for i, item in enumerate(data):
+            if i % shard_size == 0:
+                if out_file is not None:
+                    out_file.close()
+                written_paths.append(get_shard_path(jsonl_path, len(written_paths) + 1))
+                out_file = open(written_paths[-1], "w")
+                if header:
+                    out_file.write(f"{json.dumps(header)}\n")
+            out_file.write(f"{json.dumps(item)}\n")
+    finally:
+        if out_file is not None:
+            out_file.close()
+    return written_paths
+
+
+def index_by_id(sentences: List[dict]) -> dict:
+    """
+    Index a list of sentences by id. When an id appears several times, the first sentence is kept.
+    :param sentences: a list of sentences with an 'id' field
+    :return: a dictionary id -> sentence
+    """
+    sentences_by_id = {}
+    for sent in sentences:
+        sentences_by_id.setdefault(sent['id'], sent)
+    return sentences_by_id
+
+
+def get_similar_sentences(test_sentence_id, test_similar: dict):
+    return test_similar.get(test_sentence_id)
 
 
 def get_train_sentence(simil_sent_id, train_sentences):
+    """
+    Get a train sentence by id, from the train sentences indexed with index_by_id (or a plain list of them).
+    """
+    if isinstance(train_sentences, dict):
+        return train_sentences.get(simil_sent_id)
     for sent in train_sentences:
         if sent['id'] == simil_sent_id:
             return sent
@@ -111,6 +201,12 @@ def get_train_sentence(simil_sent_id, train_sentences):
 
 def get_example_prompt(train_sent):
     example_prompt = "\n\nExample Sentence: " + train_sent['sent']
+    if 'rel_label' not in train_sent:
+        # train sentences with a list of triples, e.g. train/*_train.jsonl
+        example_prompt += "\nExample Output: " + ", ".join(
+            str(tr['rel']).replace(" ", "_") + "(" + str(tr['sub']) + "," + str(tr['obj']) + ")"
+            for tr in train_sent.get('triples', []))
+        return example_prompt
     train_sent['rel_label'] = train_sent['rel_label'].replace(" ", "_")
     example_prompt += "\nExample Output: " + train_sent['rel_label'] + "(" + train_sent['sub_label'] + "," + train_sent['obj_label'] + ")"
     return example_prompt
@@ -122,6 +218,202 @@ def get_test_prompt(test_sentence):
     return test_prompt
 
 
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_prompts(ontology: OntologyIndex, test_sentences: Iterable[dict], train_sentences: Dict,
+                     test_train_similarity: Dict, prompt_format: str = "full",
+                     example_retriever: ExampleRetriever = None, num_examples: int = 1) -> Iterator[dict]:
+    """
+    Generate the prompt of each test sentence, one at a time.
+    :param ontology: the index of the ontology
+    :param test_sentences: the test sentences, e.g. read lazily with iter_jsonl
+    :param train_sentences: the train sentences indexed by id
+    :param test_train_similarity: the ids of the most similar train sentences for each test sentence id
+    :param prompt_format: "full" for whole prompts, "template" for the suffix of the prompts after the prefix of
+                          the compiled template of the ontology
+    :param example_retriever: optional index of train examples; when given, the num_examples nearest examples of
+                              each test sentence are used instead of the precomputed similarities
+    :return: a generator of {'id': test sentence id, 'prompt': prompt} objects,
+             or of {'id': test sentence id, 'prefix_id': prefix id, 'suffix': suffix} objects in template format
+    """
+    template = compile_prompt_template(ontology)
+    # iterate through all test sentences while generating prompts, by batches for the example retrieval
+    for batch in iter_batches(test_sentences, RETRIEVAL_BATCH_SIZE):
+        if example_retriever is not None:
+            batch_examples = example_retriever.get_examples(batch, num_examples)
+        else:
+            batch_examples = []
+            for test_sentence in batch:
+                # get the similar train sentences for the test sentence
+                similar_sents = get_similar_sentences(test_sentence['id'], test_train_similarity)
+                # we retrieve by default the first similar sentence from the list of similar sentences
+                simil_sent_id = similar_sents[0]
+                # we get the train sentence from the indexed train sentences and from there we process each field sub_label, obj_label, rel_label
+                batch_examples.append([get_train_sentence(simil_sent_id, train_sentences)])
+
+        for test_sentence, train_sents in zip(batch, batch_examples):
+            test_sentence_id = test_sentence['id']
+            # test sentence for which the prompt to be generated
+            test_sentence = test_sentence['sent']
+
+            # prompt generation logic
+            suffix = template.get_suffix(test_sentence, train_sents)
+            if prompt_format == "template":
+                yield {'id': test_sentence_id, 'prefix_id': template.prefix_id, 'suffix': suffix}
+            else:
+                yield {'id': test_sentence_id, 'prompt': template.render(suffix)}
+
+
+def iter_prompts(jsonl_path: str) -> Iterator[dict]:
+    """
+    Read a prompt file written in any format, one prompt at a time. The prompts of template files are rebuilt
+    from their prefix, found in the file itself or in its prefix file.
+    :param jsonl_path: a prompt file or a part of a sharded prompt file
+    :return: a generator of {'id': test sentence id, 'prompt': prompt} objects
+    """
+    prefixes = {}
+    for record in iter_jsonl(jsonl_path):
+        if 'prefix' in record:
+            prefixes[record['prefix_id']] = record['prefix']
+        elif 'suffix' in record:
+            if record['prefix_id'] not in prefixes:
+                prefixes.update({p['prefix_id']: p['prefix'] for p in iter_jsonl(get_prefix_path(jsonl_path))})
+            yield {'id': record['id'], 'prompt': prefixes[record['prefix_id']] + record['suffix']}
+        else:
+            yield record
+
+
+class PromptPacker:
+    """
+    Pack few-shot examples and several test sentences into prompts that fit a token budget.
+    Test sentences are added in order, as long as they fit in the budget (minus the part reserved for the
+    examples) and max_sentences is not reached. The remaining budget is then filled greedily with the examples
+    most similar to the packed sentences, as found by the example retriever, or with the given examples in order.
+    Lengths are measured with a pluggable length function (a tokenizer, by default an estimate from the number of
+    characters); the lengths of the examples and of the fixed parts of the prompts are memoized.
+    """
+
+    def __init__(self, instructions: str, token_budget: int, length_function: Callable[[str], int] = estimate_tokens,
+                 example_retriever: ExampleRetriever = None, examples: List[dict] = None, max_examples: int = 60,
+                 max_sentences: int = 50, example_budget: int = 0):
+        """
+        :param instructions: the beginning of every prompt
+        :param token_budget: maximum length of a prompt, in the unit of length_function
+        :param length_function: length of a text, e.g. lambda text: len(tokenizer.encode(text))
+        :param example_retriever: index used to pick the examples most similar to the test sentences
+        :param examples: the examples used without a retriever, by order of preference
+        :param max_examples: maximum number of examples per prompt
+        :param max_sentences: maximum number of test sentences per prompt
+        :param example_budget: part of the budget kept for the examples while the test sentences are packed
+        """
+        self.instructions = instructions
+        self.token_budget = token_budget
+        self.length_function = length_function
+        self.example_retriever = example_retriever
+        self.examples = examples or []
+        self.max_examples = max_examples
+        self.max_sentences = max_sentences
+        self.example_budget = example_budget
+        self.example_lengths = {}
+        self.fixed_length = length_function(instructions + PACKED_EXAMPLES_HEADER + PACKED_SENTENCES_HEADER +
+                                            PACKED_PROMPT_CLOSING)
+
+    @staticmethod
+    def get_example_text(example: dict) -> str:
+        return json.dumps(example, ensure_ascii=False) + "\n\n"
+
+    @staticmethod
+    def get_sentence_text(test_sentence: dict) -> str:
+        return f'Phrase (id={test_sentence["id"]}): {test_sentence["sent"]}\n'
+
+    def get_example_length(self, example: dict) -> int:
+        key = example.get('id') or json.dumps(example, sort_keys=True)
+        if key not in self.example_lengths:
+            self.example_lengths[key] = self.length_function(self.get_example_text(example))
+        return self.example_lengths[key]
+
+    def rank_examples(self, test_sentences: List[dict]) -> List[dict]:
+        """
+        Candidate examples of a prompt, the most similar to any of its test sentences first.
+        """
+        if self.example_retriever is None:
+            return self.examples
+        best_scores = {}
+        neighbours = self.example_retriever.search([sent['sent'] for sent in test_sentences], self.max_examples + 1)
+        test_ids = {sent['id'] for sent in test_sentences}
+        for test_neighbours in neighbours:
+            for i, score in test_neighbours:
+                if self.example_retriever.examples[i]['id'] not in test_ids:
+                    best_scores[i] = max(score, best_scores.get(i, score))
+        ranked = sorted(best_scores, key=lambda i: (-best_scores[i], i))
+        return [self.example_retriever.examples[i] for i in ranked]
+
+    def build_prompt(self, test_sentences: List[dict], remaining: int) -> dict:
+        examples = []
+        for example in self.rank_examples(test_sentences):
+            if len(examples) >= self.max_examples:
+                break
+            example_length = self.get_example_length(example)
+            if example_length <= remaining:
+                examples.append(example)
+                remaining -= example_length
+        prompt = self.instructions + PACKED_EXAMPLES_HEADER
+        prompt += "".join([self.get_example_text(example) for example in examples]).rstrip("\n")
+        prompt += PACKED_SENTENCES_HEADER
+        prompt += "".join([self.get_sentence_text(sent) for sent in test_sentences])
+        prompt += PACKED_PROMPT_CLOSING
+        return {'ids': [sent['id'] for sent in test_sentences], 'prompt': prompt,
+                'num_tokens': self.length_function(prompt), 'example_ids': [ex.get('id') for ex in examples]}
+
+    def get_batches(self, test_sentences: Iterable[dict],
+                    get_max_sentences: Callable[[], int] = None) -> Iterator[Tuple[List[dict], int]]:
+        """
+        Group the test sentences that fit together in a prompt.
+        :param get_max_sentences: called before each sentence for the maximum number of sentences of the current
+               group, so that it can change while the sentences are grouped (max_sentences by default)
+        :return: a generator of (test sentences, length of their text) tuples
+        """
+        sentence_budget = self.token_budget - self.fixed_length - self.example_budget
+        packed, packed_length = [], 0
+        for test_sentence in test_sentences:
+            sentence_length = self.length_function(self.get_sentence_text(test_sentence))
+            max_sentences = get_max_sentences() if get_max_sentences is not None else self.max_sentences
+            if packed and (packed_length + sentence_length > sentence_budget or len(packed) >= max_sentences):
+                yield packed, packed_length
+                packed, packed_length = [], 0
+            packed.append(test_sentence)
+            packed_length += sentence_length
+        if packed:
+            yield packed, packed_length
+
+    def pack_batch(self, test_sentences: List[dict], packed_length: int = None) -> dict:
+        """
+        Prompt of a group of test sentences, with as many examples as the rest of the budget allows.
+        """
+        if packed_length is None:
+            packed_length = sum(self.length_function(self.get_sentence_text(sent)) for sent in test_sentences)
+        return self.build_prompt(test_sentences, self.token_budget - self.fixed_length - packed_length)
+
+    def pack(self, test_sentences: Iterable[dict]) -> Iterator[dict]:
+        """
+        Pack the test sentences into prompts. A test sentence which does not fit in the budget on its own gets a
+        prompt of its own, without examples.
+        :return: a generator of {'ids': test sentence ids, 'prompt': prompt, 'num_tokens': prompt length,
+                 'example_ids': ids of the included examples} objects
+        """
+        for packed, packed_length in self.get_batches(test_sentences):
+            yield self.pack_batch(packed, packed_length)
+
+
 def get_ontology_string(ont_src_file):
     # extract substring from file name to get the ontology name
     start = ont_src_file.find('_')
@@ -134,7 +426,38 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--prompt_gen_config_path', type=str, required=True)
+    parser.add_argument('--ontology_pickle', action='store_true',
+                        help="store the compiled index of each ontology as a pickle next to its json file and "
+                             "reuse it in later runs")
+    parser.add_argument('--shard_size', type=int, default=None,
+                        help="write the prompts of each ontology in part files of at most shard_size prompts "
+                             "(e.g. ont_1_movie_prompts_part1_.jsonl), to be processed by parallel LLM workers")
+    parser.add_argument('--prompt_format', type=str, default="full", choices=["full", "template"],
+                        help="full: one whole prompt per line; template: one (prefix_id, suffix) pair per line, the "
+                             "prefix shared by the prompts of an ontology being written once in a prefix file")
+    parser.add_argument('--prefix_in_file', action='store_true',
+                        help="with --prompt_format template, write the prefix at the beginning of each prompt file "
+                             "instead of a separate prefix file")
+    parser.add_argument('--num_examples', type=int, default=None,
+                        help="pick this many few-shot examples per test sentence with the example index built from "
+                             "the 'example_sources' of the config, instead of the precomputed 'sent_sim' files")
+    parser.add_argument('--token_budget', type=int, default=None,
+                        help="pack several test sentences and their most similar examples in each prompt, "
+                             "within this number of (estimated) tokens")
+    parser.add_argument('--max_sentences', type=int, default=50,
+                        help="with --token_budget, maximum number of test sentences per prompt")
+    parser.add_argument('--example_budget', type=int, default=0,
+                        help="with --token_budget, number of tokens kept for the examples of each prompt")
+    parser.add_argument('--instructions_file', type=str, default=None,
+                        help="with --token_budget, file with the instructions of the prompts "
+                             "(e.g. event_json_to_ttl/prompts/promptSimple.txt); by default the ontology context")
     args = parser.parse_args()
+    if args.shard_size is not None and args.shard_size < 1:
+        parser.error("--shard_size must be a positive integer")
+    if args.num_examples is not None and args.num_examples < 1:
+        parser.error("--num_examples must be a positive integer")
+    if args.token_budget is not None and args.prompt_format == "template":
+        parser.error("--token_budget prompts cannot be written in template format")
     prompt_gen_config_path = args.prompt_gen_config_path
 
     # load the prompt generation configuration with details of files needed for prompt generation
@@ -142,52 +465,65 @@ if __name__ == "__main__":
     # file, training sentences file, test-train sentence similarity file, and the output file.
     # Check wikidata_tekgen_unseen_prompt_gen_config.json for an example.
     prompt_gen_config = load_json(prompt_gen_config_path)
-    prompts = []
-    prompts_json = []
     onto_list = prompt_gen_config["onto_list"]
 
+    # The few-shot examples can be retrieved on the fly from an index of train sentences shared by all the
+    # ontologies, e.g. "example_sources": ["../../train/*_train.jsonl", "../../event_json_to_ttl/data/new_train.jsonl"].
+    # The index is persisted in the "example_index" file of the config, if any, and rebuilt when the sources change.
+    example_retriever = None
+    if args.num_examples:
+        example_retriever = ExampleRetriever.from_sources(prompt_gen_config["example_sources"],
+                                                          prompt_gen_config.get("example_index"))
+
     # for each of the ontology, we load the corresponding files and generate the prompts for each test sentence
     for onto in onto_list:
-        # load the ontology which has the concepts and relations (with domain / range constraints)
+        # load the ontology which has the concepts and relations (with domain / range constraints), compiled once
+        # into an index with its verbalized concepts and relations
         ontology_file = prompt_gen_config["path_patterns"]["onto"].replace("$$onto$$", onto)
-        ontology = load_json(ontology_file)
+        ontology = OntologyIndex.load(ontology_file, args.ontology_pickle)
 
-        # load the list of test sentences for which we need to generate the prompts.
+        # the test sentences for which we need to generate the prompts are read one at a time.
         test_file = prompt_gen_config["path_patterns"]["test"].replace("$$onto$$", onto)
-        test_sentences = load_jsonl(test_file)
-
-        # load the list of train sentences. We use the train sentences with aligned triples to find the examples to
-        # include in the prompt.
-        train_file = prompt_gen_config["path_patterns"]["train"].replace("$$onto$$", onto)
-        train_sentences = load_jsonl(train_file)
-
-        # In the prompt, for each test sentence, we are using the most similar train sentence as the example for
-        # in-context learning. This files contains pre-calculated similarities for each test sentence using a T5XXL
-        # SBERT model.
-        test_train_similarity_file = prompt_gen_config["path_patterns"]["sent_sim"].replace("$$onto$$", onto)
-        test_train_similarity = load_json(test_train_similarity_file)
-
-        # iterate through all test sentences while generating prompts
-        for test_sentence in test_sentences:
-            test_sentence_id = test_sentence['id']
-            # test sentence for which the prompt to be generated
-            test_sentence = test_sentence['sent']
-
-            # get the similar train sentences for the test sentence
-            similar_sents = get_similar_sentences(test_sentence_id, test_train_similarity)
-            # we retrieve by default the first similar sentence from the list of similar sentences
-            simil_sent_id = similar_sents[0]
-
-            # we get the train sentence from the train sentences list and from there we process each field sub_label, obj_label, rel_label
-            train_sent = get_train_sentence(simil_sent_id, train_sentences)
-
-            # prompt generation logic
-            prompt = prepare_prompt(ontology, test_sentence, train_sent)
-            prompts.append(prompt)
-            prompt_data = {'id': test_sentence_id, 'prompt': prompt}
-            prompts_json.append(prompt_data)
+        test_sentences = iter_jsonl(test_file)
 
         output_path = prompt_gen_config["path_patterns"]["prompt"].replace("$$onto$$", onto)
-        save_jsonl(prompts_json, output_path)
+        if args.token_budget:
+            # several test sentences per prompt, with as many of their most similar examples as fit in the budget
+            if args.instructions_file:
+                with open(args.instructions_file, 'r', encoding='utf-8') as f:
+                    instructions = f.read()
+            else:
+                instructions = get_ontology_prompt(ontology)
+            train_file = prompt_gen_config["path_patterns"]["train"].replace("$$onto$$", onto)
+            prompt_packer = PromptPacker(instructions, args.token_budget, example_retriever=example_retriever,
+                                         examples=None if example_retriever else load_jsonl(train_file),
+                                         max_examples=args.num_examples or 60, max_sentences=args.max_sentences,
+                                         example_budget=args.example_budget)
+            save_jsonl_shards(prompt_packer.pack(test_sentences), output_path, args.shard_size)
+            continue
 
-        prompts_json = []
+        train_sentences, test_train_similarity = None, None
+        if example_retriever is None:
+            # load the list of train sentences. We use the train sentences with aligned triples to find the examples
+            # to include in the prompt.
+            train_file = prompt_gen_config["path_patterns"]["train"].replace("$$onto$$", onto)
+            train_sentences = index_by_id(load_jsonl(train_file))
+
+            # In the prompt, for each test sentence, we are using the most similar train sentence as the example for
+            # in-context learning. This files contains pre-calculated similarities for each test sentence using a
+            # T5XXL SBERT model.
+            test_train_similarity_file = prompt_gen_config["path_patterns"]["sent_sim"].replace("$$onto$$", onto)
+            test_train_similarity = load_json(test_train_similarity_file)
+
+        # each prompt is written as soon as it is generated, so memory does not grow with the number of test
+        # sentences
+        prompts_json = generate_prompts(ontology, test_sentences, train_sentences, test_train_similarity,
+                                        args.prompt_format, example_retriever, args.num_examples)
+        # in template format, the prefix of the ontology is written once per file or in a separate prefix file
+        prefix_record = None
+        if args.prompt_format == "template":
+            prefix_record = compile_prompt_template(ontology).get_prefix_record()
+            if not args.prefix_in_file:
+                save_jsonl([prefix_record], get_prefix_path(output_path))
+                prefix_record = None
+        save_jsonl_shards(prompts_json, output_path, args.shard_size, prefix_record)
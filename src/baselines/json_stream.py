@@ -0,0 +1,172 @@
+import argparse
+import json
+import re
+import sys
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+# Tokens that change the state of the parser inside an object: a whole string is skipped in one match,
+# a lone quote opens a string that continues in the next chunk
+STRUCTURE_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}"]', re.DOTALL)
+# Characters that end or escape inside a string
+STRING_PATTERN = re.compile(r'["\\]')
+
+DECODER = json.JSONDecoder()
+
+
+class JsonStreamParser:
+    """
+    Incremental parser of the JSON objects of an LLM answer. The answer is scanned once, chunk by chunk, with a
+    brace-depth state machine that knows about strings and escapes, so the objects are found whatever the
+    surrounding text (```json fences, prose, a top-level array, one object per line) and whatever their nesting.
+    Each top-level object is decoded as soon as its closing brace arrives, so an answer can be parsed while it is
+    streamed. Fragments that do not decode, and an object left unterminated at close(), are reported to on_invalid.
+    An object that starts and ends in the same chunk is first decoded directly by the C decoder of json: the state
+    machine only scans the objects split across chunks or malformed.
+    """
+
+    def __init__(self, on_invalid: Callable[[str, str], None] = None):
+        self.on_invalid = on_invalid
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        # chunks of the current object, before the chunk being scanned
+        self.parts = []
+
+    def feed(self, chunk: str) -> Iterator[Any]:
+        """
+        Scan the next chunk of the answer and yield the objects it closes.
+        """
+        i = 0
+        start = 0
+        if self.escape and chunk:
+            self.escape = False
+            i = 1
+        while i < len(chunk):
+            if self.depth == 0:
+                i = chunk.find("{", i)
+                if i < 0:
+                    break
+                start = i
+                try:
+                    parsed, i = DECODER.raw_decode(chunk, i)
+                    yield parsed
+                    continue
+                except json.JSONDecodeError:
+                    pass
+                self.depth = 1
+                i += 1
+            elif self.in_string:
+                match = STRING_PATTERN.search(chunk, i)
+                if match is None:
+                    break
+                i = match.end()
+                if match.group() == '"':
+                    self.in_string = False
+                elif i == len(chunk):
+                    # the escaped character is the first one of the next chunk
+                    self.escape = True
+                else:
+                    i += 1
+            else:
+                match = STRUCTURE_PATTERN.search(chunk, i)
+                if match is None:
+                    break
+                i = match.end()
+                char = match.group()
+                if char[0] == '"':
+                    self.in_string = len(char) == 1
+                elif char == "{":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        fragment = "".join(self.parts) + chunk[start:i]
+                        self.parts = []
+                        parsed = self.decode(fragment)
+                        if parsed is not None:
+                            yield parsed
+        if self.depth > 0:
+            self.parts.append(chunk[start:])
+
+    def decode(self, fragment: str) -> Optional[Any]:
+        try:
+            return json.loads(fragment)
+        except json.JSONDecodeError as e:
+            self.report(fragment, str(e))
+            return None
+
+    def report(self, fragment: str, error: str) -> None:
+        if self.on_invalid is not None:
+            self.on_invalid(fragment, error)
+
+    def close(self) -> None:
+        """
+        End of the answer: an object still open is reported as invalid.
+        """
+        if self.depth > 0:
+            self.report("".join(self.parts), "unterminated object")
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.parts = []
+
+
+def iter_json_objects(chunks: Iterable[str], on_invalid: Callable[[str, str], None] = None) -> Iterator[Any]:
+    """
+    Objects of an answer given as an iterable of chunks (e.g. the tokens of a streamed response).
+    """
+    parser = JsonStreamParser(on_invalid)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
+
+
+def parse_json_objects(text: str, on_invalid: Callable[[str, str], None] = None) -> List[Any]:
+    return list(iter_json_objects([text], on_invalid))
+
+
+class InvalidFragmentLog:
+    """
+    Side channel of the malformed fragments: one JSON line per fragment, with the error and an optional context
+    (e.g. the ids of the prompt), appended to a file such as debug_invalid.json.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.out_file = None
+
+    def write(self, fragment: str, error: str, context=None) -> None:
+        if self.out_file is None:
+            self.out_file = open(self.path, "a", encoding="utf-8")
+        self.out_file.write(json.dumps({"context": context, "error": error, "fragment": fragment},
+                                       ensure_ascii=False) + "\n")
+        self.out_file.flush()
+        self.count += 1
+
+    def reporter(self, context=None) -> Callable[[str, str], None]:
+        return lambda fragment, error: self.write(fragment, error, context)
+
+    def close(self) -> None:
+        if self.out_file is not None:
+            self.out_file.close()
+            self.out_file = None
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Extract the JSON objects of raw LLM answers (stdin or files)")
+    parser.add_argument('inputs', type=str, nargs='*', help="raw answer files, stdin by default")
+    parser.add_argument('--debug_invalid', type=str, default="debug_invalid.json",
+                        help="file receiving the malformed fragments")
+    args = parser.parse_args()
+
+    invalid_log = InvalidFragmentLog(args.debug_invalid)
+    for input_path in args.inputs or ["-"]:
+        in_file = sys.stdin if input_path == "-" else open(input_path, "r", encoding="utf-8")
+        with in_file:
+            for obj in iter_json_objects(iter(lambda: in_file.read(1 << 16), ""), invalid_log.reporter(input_path)):
+                print(json.dumps(obj, ensure_ascii=False))
+    invalid_log.close()
+    if invalid_log.count:
+        print(f"⚠️ {invalid_log.count} fragments invalides dans {args.debug_invalid}", file=sys.stderr)
@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+logger = logging.getLogger("llama_server")
+
+
+class LlamaWorker:
+    """
+    Long-lived llama_cpp model: the model is loaded once and kept resident, and prompts are completed one at a time
+    with echo=False, so that only the completion comes back.
+    Prompts given as a (prefix_id, suffix) pair, as written by gen_prompt.py --prompt_format template, reuse the
+    KV cache of their prefix: the model state after the prefix is saved once (for the max_prefix_states most
+    recent prefixes) and restored before a prompt of another prefix, so only the suffix is evaluated. Consecutive
+    full prompts also reuse the tokens they share with the previous prompt, which llama_cpp keeps in its context.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int = 2048, n_threads: int = None, max_tokens: int = 250,
+                 temperature: float = 0, max_prefix_states: int = 4, cache_mb: int = 0):
+        from llama_cpp import Llama, LlamaRAMCache
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+        if cache_mb:
+            # states of the previous prompts, looked up by longest common token prefix
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=cache_mb << 20))
+        self.model = os.path.basename(model_path)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.max_prefix_states = max_prefix_states
+        self.prefixes = {}
+        # prefix_id -> model state after the prefix, least recently used first
+        self.prefix_states = OrderedDict()
+        self.prefix_lengths = {}
+        self.loaded_prefix = None
+
+    def add_prefix(self, prefix_id: str, prefix: str) -> None:
+        self.prefixes[prefix_id] = prefix
+
+    def warm_prefix(self, prefix_id: str) -> int:
+        """
+        Put the state after the prefix in the context of the model, evaluating the prefix the first time.
+        :return: the number of prefix tokens that did not have to be evaluated
+        """
+        if self.loaded_prefix == prefix_id:
+            # the context still starts with the prefix, followed by the previous suffix and completion
+            return self.prefix_lengths[prefix_id]
+        if prefix_id in self.prefix_states:
+            self.prefix_states.move_to_end(prefix_id)
+            self.llm.load_state(self.prefix_states[prefix_id])
+            self.loaded_prefix = prefix_id
+            return self.prefix_lengths[prefix_id]
+        tokens = self.llm.tokenize(self.prefixes[prefix_id].encode("utf-8"))
+        self.llm.reset()
+        self.llm.eval(tokens)
+        self.prefix_lengths[prefix_id] = len(tokens)
+        self.prefix_states[prefix_id] = self.llm.save_state()
+        if len(self.prefix_states) > self.max_prefix_states:
+            self.prefix_states.popitem(last=False)
+        self.loaded_prefix = prefix_id
+        return 0
+
+    def complete(self, request: Dict) -> Dict:
+        start_time = time.time()
+        reused_tokens = 0
+        if request.get("prefix_id") is not None:
+            if request["prefix_id"] not in self.prefixes:
+                raise KeyError(f"unknown prefix_id {request['prefix_id']}")
+            reused_tokens = self.warm_prefix(request["prefix_id"])
+            prompt = self.prefixes[request["prefix_id"]] + request["suffix"]
+        else:
+            self.loaded_prefix = None
+            prompt = request["prompt"]
+        output = self.llm(prompt, max_tokens=request.get("max_tokens") or self.max_tokens, echo=False,
+                          temperature=request.get("temperature", self.temperature), stop=request.get("stop"))
+        usage = output.get("usage", {})
+        return {"id": request.get("id"), "text": output["choices"][0]["text"],
+                "input_tokens": usage.get("prompt_tokens"), "output_tokens": usage.get("completion_tokens"),
+                "reused_tokens": reused_tokens, "elapsed": round(time.time() - start_time, 3)}
+
+
+class LlamaServer:
+    """
+    Local server of a LlamaWorker: clients send one JSON object per line over a TCP or Unix socket and get one
+    JSON object per line back, in the order of their requests.
+        {"op": "prefix", "prefix_id": ..., "prefix": ...}       register a shared prefix
+        {"id": ..., "prompt": ...}                                complete a full prompt
+        {"id": ..., "prefix_id": ..., "suffix": ...}              complete a prefix + suffix prompt
+    Pending requests are completed one by one, those of the prefix already in the model context first,
+    so that interleaved clients do not keep swapping the prefix states.
+    """
+
+    def __init__(self, worker: LlamaWorker):
+        self.worker = worker
+        self.pending = []
+        self.condition = asyncio.Condition()
+
+    async def submit(self, request: Dict) -> Dict:
+        future = asyncio.get_running_loop().create_future()
+        async with self.condition:
+            self.pending.append((request, future))
+            self.condition.notify()
+        return await future
+
+    def next_request(self):
+        for i, (request, _) in enumerate(self.pending):
+            if request.get("prefix_id") is not None and request.get("prefix_id") == self.worker.loaded_prefix:
+                return self.pending.pop(i)
+        return self.pending.pop(0)
+
+    async def run_worker(self) -> None:
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.pending)
+                request, future = self.next_request()
+            try:
+                response = await asyncio.to_thread(self.worker.complete, request)
+                logger.info("✅ %s tokens (%s réutilisés), %.2fs", response["input_tokens"], response["reused_tokens"],
+                            response["elapsed"])
+            except Exception as e:
+                logger.warning("⚠️ 请求失败 %s: %s", request.get("id"), e)
+                response = {"id": request.get("id"), "error": str(e)}
+            if not future.cancelled():
+                future.set_result(response)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    response = {"error": f"invalid request: {e}"}
+                else:
+                    if request.get("op") == "prefix":
+                        self.worker.add_prefix(request["prefix_id"], request["prefix"])
+                        response = {"prefix_id": request["prefix_id"]}
+                    else:
+                        response = await self.submit(request)
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_socket: str = None) -> None:
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle, path=unix_socket, limit=1 << 24)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=1 << 24)
+        worker_task = asyncio.create_task(self.run_worker())
+        logger.info("🚀 %s prêt sur %s", self.worker.model, unix_socket or f"{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker_task.cancel()
+
+
+class LlamaServerClient:
+    """
+    Client of a LlamaServer, with one connection per request.
+    Each prefix is registered on the server once per client; if the server does not know it any more
+    (e.g. after a restart), it is registered again.
+    """
+
+    def __init__(self, address: str):
+        """
+        :param address: host:port of a TCP server, or the path of a Unix socket
+        """
+        self.address = address
+        # prefix_ids already registered on the server
+        self.sent_prefixes = set()
+
+    async def connect(self):
+        if ":" in self.address and not os.path.exists(self.address):
+            host, port = self.address.rsplit(":", 1)
+            return await asyncio.open_connection(host, int(port), limit=1 << 24)
+        return await asyncio.open_unix_connection(self.address, limit=1 << 24)
+
+    async def send(self, requests: List[Dict]) -> List[Dict]:
+        reader, writer = await self.connect()
+        try:
+            writer.write("".join(json.dumps(request, ensure_ascii=False) + "\n" for request in requests)
+                         .encode("utf-8"))
+            await writer.drain()
+            return [json.loads(await reader.readline()) for _ in requests]
+        finally:
+            writer.close()
+
+    async def complete(self, prompt: str, prefix_id: str = None, prefix: str = None, **params) -> Dict:
+        """
+        Complete a prompt. With a prefix (and its prefix_id), the prompt is sent as its suffix, so that the server
+        reuses the KV cache of the prefix; the first time, the prefix is registered in the same connection.
+        """
+        if prefix_id is None:
+            response = (await self.send([{"prompt": prompt, **params}]))[-1]
+        else:
+            request = {"prefix_id": prefix_id, "suffix": prompt[len(prefix):], **params}
+            response = None
+            if prefix_id in self.sent_prefixes:
+                response = (await self.send([request]))[-1]
+                if "unknown prefix_id" in response.get("error", ""):
+                    self.sent_prefixes.discard(prefix_id)
+                    response = None
+            if response is None:
+                response = (await self.send([{"op": "prefix", "prefix_id": prefix_id, "prefix": prefix},
+                                             request]))[-1]
+                self.sent_prefixes.add(prefix_id)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve a llama_cpp model on a local socket")
+    parser.add_argument('--model_path', type=str, required=True, help="e.g. ./models/ggml-toolpaca-13b-4bit.bin")
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix_socket', type=str, default=None, help="listen on this Unix socket instead of TCP")
+    parser.add_argument('--n_ctx', type=int, default=2048)
+    parser.add_argument('--n_threads', type=int, default=None)
+    parser.add_argument('--max_tokens', type=int, default=250, help="default maximum number of generated tokens")
+    parser.add_argument('--temperature', type=float, default=0)
+    parser.add_argument('--max_prefix_states', type=int, default=4,
+                        help="number of prefix KV states kept in memory")
+    parser.add_argument('--cache_mb', type=int, default=0,
+                        help="size of the llama_cpp RAM cache of the previous prompt states, 0 to disable")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+
+    print("Loading model...")
+    start_time = time.time()
+    llama_worker = LlamaWorker(args.model_path, args.n_ctx, args.n_threads, args.max_tokens, args.temperature,
+                               args.max_prefix_states, args.cache_mb)
+    print(f"Model loading time: {time.time() - start_time}")
+    try:
+        asyncio.run(LlamaServer(llama_worker).serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,746 @@
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from adaptive_batching import AdaptiveBatchSize, load_batch_sizes, save_batch_sizes
+from checkpoint_journal import CheckpointJournal, compact
+from gen_prompt import PACKED_EXAMPLES_HEADER, PromptPacker, PromptTemplate, get_prefix_path, iter_jsonl, \
+    iter_prompts
+from json_stream import InvalidFragmentLog, parse_json_objects
+from response_cache import ResponseCache, get_cache_key
+from run_metrics import RunMetrics
+
+logger = logging.getLogger("llm_runner")
+
+# Counters reported at the end of the run (requests, retries, failures, tokens...)
+COUNTERS = Counter()
+
+# Test sentences of the prompts packed by gen_prompt.PromptPacker, e.g. "Phrase (id=12269_ouverture): ..."
+PACKED_SENTENCE_PATTERN = re.compile(r"^Phrase \(id=([^)]*)\): (.*)$", re.MULTILINE)
+
+
+class LLMProvider:
+    """
+    Provider-agnostic interface of the LLMs: generate() sends one prompt and returns the generated text with the
+    number of input and output tokens, when the provider reports them.
+    Providers whose client is synchronous run it in a thread, so that they do not block the event loop.
+    get_model() describes the model and its decoding params, which are part of the response cache keys.
+    """
+    name = "provider"
+
+    async def generate(self, prompt: str) -> Dict:
+        raise NotImplementedError
+
+    def get_model(self) -> Dict:
+        return {"provider": self.name}
+
+    def close(self) -> None:
+        pass
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Gemini models through Vertex AI (google-genai), as in code.ipynb.
+    """
+    name = "gemini"
+
+    def __init__(self, model: str, project: str = None, location: str = "us-central1", temperature: float = None,
+                 max_tokens: int = None):
+        from google import genai
+        from google.genai import types
+        self.model = model
+        self.client = genai.Client(vertexai=True, project=project, location=location)
+        self.config = types.GenerateContentConfig(temperature=temperature, max_output_tokens=max_tokens)
+        self.params = {"temperature": temperature, "max_tokens": max_tokens}
+
+    async def generate(self, prompt: str) -> Dict:
+        response = await self.client.aio.models.generate_content(model=self.model, contents=prompt,
+                                                                 config=self.config)
+        usage = response.usage_metadata
+        return {"text": response.text or "",
+                "input_tokens": getattr(usage, "prompt_token_count", None),
+                "output_tokens": getattr(usage, "candidates_token_count", None)}
+
+    def get_model(self) -> Dict:
+        return {"provider": self.name, "model": self.model, **self.params}
+
+
+class OpenAIProvider(LLMProvider):
+    """
+    OpenAI chat models (or any OpenAI compatible server, with base_url).
+    """
+    name = "openai"
+
+    def __init__(self, model: str, temperature: float = None, max_tokens: int = None, base_url: str = None):
+        import openai
+        self.model = model
+        self.base_url = base_url
+        self.client = openai.AsyncOpenAI(base_url=base_url)
+        self.params = {key: value for key, value in [("temperature", temperature), ("max_tokens", max_tokens)]
+                       if value is not None}
+
+    async def generate(self, prompt: str) -> Dict:
+        response = await self.client.chat.completions.create(
+            model=self.model, messages=[{"role": "user", "content": prompt}], **self.params)
+        return {"text": response.choices[0].message.content or "",
+                "input_tokens": response.usage.prompt_tokens if response.usage else None,
+                "output_tokens": response.usage.completion_tokens if response.usage else None}
+
+    def get_model(self) -> Dict:
+        return {"provider": self.name, "model": self.model, "base_url": self.base_url, **self.params}
+
+
+class LlamaCppProvider(LLMProvider):
+    """
+    Local model loaded with llama_cpp.Llama, as in vicuna-alpaca-test-v4.py. The model is not thread-safe,
+    so completions are serialized whatever the concurrency of the runner.
+    """
+    name = "llama_cpp"
+
+    def __init__(self, model_path: str, temperature: float = 0, max_tokens: int = 250):
+        from llama_cpp import Llama
+        self.model_path = model_path
+        self.llm = Llama(model_path=model_path)
+        self.temperature = 0 if temperature is None else temperature
+        self.max_tokens = max_tokens or 250
+        self.lock = asyncio.Lock()
+
+    def complete(self, prompt: str) -> Dict:
+        output = self.llm(prompt, max_tokens=self.max_tokens, echo=False, temperature=self.temperature)
+        usage = output.get("usage", {})
+        return {"text": output["choices"][0]["text"],
+                "input_tokens": usage.get("prompt_tokens"),
+                "output_tokens": usage.get("completion_tokens")}
+
+    async def generate(self, prompt: str) -> Dict:
+        async with self.lock:
+            return await asyncio.to_thread(self.complete, prompt)
+
+    def get_model(self) -> Dict:
+        return {"provider": self.name, "model": os.path.basename(self.model_path), "temperature": self.temperature,
+                "max_tokens": self.max_tokens}
+
+
+class LlamaServerProvider(LLMProvider):
+    """
+    Model served by llama_server.py, loaded once for all the runs. Prompts starting with one of the known
+    prefixes (the shared part of the prompts of an ontology or of the packed prompts) are sent as a suffix of
+    that prefix, so that the server does not evaluate the prefix again.
+    """
+    name = "llama_server"
+
+    def __init__(self, address: str, model: str = None, temperature: float = 0, max_tokens: int = 250,
+                 prefixes: Dict[str, str] = None):
+        from llama_server import LlamaServerClient
+        self.address = address
+        self.model = model or address
+        self.client = LlamaServerClient(address)
+        self.params = {"temperature": 0 if temperature is None else temperature, "max_tokens": max_tokens or 250}
+        self.prefixes = prefixes or {}
+
+    def add_prefix(self, prefix: str) -> None:
+        self.prefixes[PromptTemplate(prefix).prefix_id] = prefix
+
+    async def generate(self, prompt: str) -> Dict:
+        prefix_id = next((prefix_id for prefix_id, prefix in self.prefixes.items() if prompt.startswith(prefix)),
+                         None)
+        response = await self.client.complete(prompt, prefix_id, self.prefixes.get(prefix_id), **self.params)
+        return {"text": response["text"], "input_tokens": response.get("input_tokens"),
+                "output_tokens": response.get("output_tokens")}
+
+    def get_model(self) -> Dict:
+        return {"provider": self.name, "model": self.model, **self.params}
+
+
+def load_prompt_prefixes(prompt_paths: List[str]) -> Dict[str, str]:
+    """
+    Prefixes of prompt files written in template format: those of their prefix files and those written at the
+    beginning of the files.
+    """
+    prefixes = {}
+    for prompt_path in prompt_paths:
+        prefix_path = get_prefix_path(prompt_path)
+        records = list(iter_jsonl(prefix_path)) if os.path.exists(prefix_path) else []
+        records += [next(iter_jsonl(prompt_path), {})]
+        prefixes.update({record['prefix_id']: record['prefix'] for record in records if 'prefix' in record})
+    return prefixes
+
+
+def fake_response(prompt: str) -> str:
+    """
+    Answer of the fake provider: one JSON line per packed test sentence, without triples.
+    """
+    lines = [json.dumps({"id": sent_id, "response": sent, "triples": []}, ensure_ascii=False)
+             for sent_id, sent in PACKED_SENTENCE_PATTERN.findall(prompt)]
+    return "\n".join(lines)
+
+
+class FakeProvider(LLMProvider):
+    """
+    Local fake provider to test the runner without any model: it answers after a random latency and fails
+    at a given rate.
+    """
+    name = "fake"
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0, seed: int = 0,
+                 respond: Callable[[str], str] = fake_response):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.respond = respond
+
+    async def generate(self, prompt: str) -> Dict:
+        await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        if self.random.random() < self.failure_rate:
+            raise RuntimeError("fake provider failure")
+        text = self.respond(prompt)
+        return {"text": text, "input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+
+
+def get_provider(args) -> LLMProvider:
+    if args.provider == "gemini":
+        return GeminiProvider(args.model, args.project, args.location, args.temperature, args.max_tokens)
+    if args.provider == "openai":
+        return OpenAIProvider(args.model, args.temperature, args.max_tokens, args.base_url)
+    if args.provider == "llama_cpp":
+        return LlamaCppProvider(args.model_path, args.temperature, args.max_tokens)
+    if args.provider == "llama_server":
+        return LlamaServerProvider(args.server_address, os.path.basename(args.model_path or "") or None,
+                                   args.temperature, args.max_tokens, load_prompt_prefixes(args.prompts or []))
+    return FakeProvider(args.fake_latency, args.fake_failure_rate)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: the bucket holds at most capacity tokens and is refilled at rate tokens per second.
+    acquire() waits until the requested number of tokens is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1) -> None:
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def get_backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter: a random delay between 0 and base_delay * 2^attempt, capped at max_delay.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def parse_llm_output(raw_output: str, on_invalid: Callable[[str, str], None] = None) -> List[Dict]:
+    """
+    Parse the JSON objects of an LLM answer (```json blocks, bare objects, one object per line, or an array of
+    objects) in a single scan; malformed fragments are reported to on_invalid.
+    """
+    return parse_json_objects(raw_output, on_invalid)
+
+
+def get_record_ids(record: Dict) -> List:
+    """
+    Ids of the test sentences of a prompt record: 'ids' for packed prompts, 'id' otherwise.
+    """
+    return record['ids'] if 'ids' in record else [record['id']]
+
+
+class RotatingJsonlWriter:
+    """
+    Append json objects to .jsonl files, switching to a new part file every records_per_file objects
+    e.g. output_llm_responses_part1.jsonl, output_llm_responses_part2.jsonl, ...
+    Files are written in binary mode, so that the byte offset of each line can be recorded in a checkpoint journal;
+    a resumed run starts at the count of records already written in the part files (by default).
+    A part file is fsynced before it is closed, since the checkpoint journal only syncs the open files.
+    """
+
+    def __init__(self, output_dir: str, base: str, records_per_file: int = 10000, count: int = None):
+        self.output_dir = output_dir
+        self.base = base
+        self.records_per_file = records_per_file
+        self.out_file = None
+        os.makedirs(output_dir, exist_ok=True)
+        self.count = self.count_records() if count is None else count
+
+    def get_path(self, file_idx: int) -> str:
+        return os.path.normpath(os.path.join(self.output_dir, f"{self.base}_llm_responses_part{file_idx}.jsonl"))
+
+    def count_records(self) -> int:
+        """
+        Number of records already written in the part files, one per line.
+        """
+        count = 0
+        file_idx = 1
+        while os.path.exists(self.get_path(file_idx)):
+            with open(self.get_path(file_idx), "rb") as in_file:
+                count += sum(chunk.count(b"\n") for chunk in iter(lambda: in_file.read(1 << 20), b""))
+            file_idx += 1
+        return count
+
+    def close_file(self) -> None:
+        self.out_file.flush()
+        os.fsync(self.out_file.fileno())
+        self.out_file.close()
+        self.out_file = None
+
+    def write(self, item: Dict):
+        """
+        Write one object. Returns the file it was written to and the offset of its line.
+        """
+        if self.out_file is None or self.count % self.records_per_file == 0:
+            if self.out_file is not None:
+                self.close_file()
+                logger.info("---- 切换到下一个输出文件 ----")
+            self.out_file = open(self.get_path(self.count // self.records_per_file + 1), "ab")
+        offset = self.out_file.tell()
+        self.out_file.write((json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.count += 1
+        return self.out_file, offset
+
+    def close(self) -> None:
+        if self.out_file is not None:
+            self.close_file()
+
+
+class LLMRunner:
+    """
+    Send prompts to an LLM provider concurrently with asyncio. At most `concurrency` requests are in flight,
+    requests (and, optionally, input tokens) are rate limited with token buckets, and failed requests are
+    retried with exponential backoff and jitter.
+    In "json" response format, a request succeeds when the answer holds at least one JSON object with an id per
+    test sentence of the prompt, as in the notebook; in "text" format, the raw answer is written.
+    Prompt records are read lazily, so memory does not grow with the number of prompts.
+    With a checkpoint journal, the ids of the written responses are journaled and the prompts whose ids are all
+    in the journal are skipped, so that an interrupted run can be resumed.
+    With a response cache, valid answers are cached and a cached prompt is answered without any request.
+    Besides prompt records, the runner processes batches of test sentences (lists of {'id', 'sent'}) that it packs
+    itself with a PromptPacker: every id of a batch must come back in the answer, the answered ids are written and
+    only the missing ones are sent again, split in two halves, down to single sentences retried with backoff.
+    With an AdaptiveBatchSize, the size of the batches follows the success rate of the model.
+    Requests, answers and cache lookups are recorded in a RunMetrics.
+    """
+
+    def __init__(self, provider: LLMProvider, writer: RotatingJsonlWriter, concurrency: int = 8,
+                 requests_per_minute: float = None, tokens_per_minute: float = None, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0, response_format: str = "json",
+                 journal: CheckpointJournal = None, cache: ResponseCache = None,
+                 invalid_log: InvalidFragmentLog = None, packer: PromptPacker = None,
+                 batch_size: AdaptiveBatchSize = None, metrics: RunMetrics = None):
+        self.provider = provider
+        self.writer = writer
+        self.journal = journal
+        self.cache = cache
+        self.invalid_log = invalid_log
+        self.concurrency = concurrency
+        self.request_bucket = TokenBucket(requests_per_minute / 60) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.response_format = response_format
+        self.packer = packer
+        self.batch_size = batch_size
+        self.metrics = metrics or RunMetrics()
+
+    def parse(self, ids: List, text: str) -> List[Dict]:
+        on_invalid = self.invalid_log.reporter(ids) if self.invalid_log is not None else None
+        return [parsed for parsed in parse_llm_output(text, on_invalid)
+                if isinstance(parsed, dict) and parsed.get("id")]
+
+    def get_results(self, record: Dict, text: str) -> Optional[List[Dict]]:
+        """
+        Objects to write for the answer of a prompt, or None when the answer is not valid.
+        """
+        ids = get_record_ids(record)
+        if self.response_format == "text":
+            return [{"id": ids[0] if len(ids) == 1 else ids, "response": text}]
+        results = self.parse(ids, text)
+        if not results or len(results) < len(ids):
+            logger.warning("⚠️ 批量输出解析失败或条数不足，应有%d条，实际%d条", len(ids), len(results))
+            return None
+        return results
+
+    def get_cached(self, record: Dict):
+        """
+        Cache key of a prompt and its cached answer, if any.
+        """
+        if self.cache is None:
+            return None, None
+        cache_key = get_cache_key(self.provider.get_model(), record['prompt'])
+        cached = self.cache.get(cache_key)
+        self.metrics.record_cache(cached is not None)
+        return cache_key, cached
+
+    async def request(self, record: Dict, attempt: int = 0) -> Optional[Dict]:
+        """
+        Send a prompt once the rate limits allow it. Returns the answer of the provider, or None when it failed.
+        """
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire()
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire(record.get('num_tokens') or len(record['prompt']) // 4)
+        COUNTERS["requests"] += 1
+        batch_size = len(get_record_ids(record))
+        start_time = time.monotonic()
+        try:
+            response = await self.provider.generate(record['prompt'])
+        except Exception as e:
+            self.metrics.record_request(time.monotonic() - start_time, batch_size, attempt, False)
+            logger.warning("⚠️ 请求失败 %s: %s", get_record_ids(record), e)
+            return None
+        self.metrics.record_request(time.monotonic() - start_time, batch_size, attempt, True,
+                                    response.get("input_tokens"), response.get("output_tokens"))
+        COUNTERS["input_tokens"] += response.get("input_tokens") or 0
+        COUNTERS["output_tokens"] += response.get("output_tokens") or 0
+        return response
+
+    async def process(self, record: Dict) -> bool:
+        ids = get_record_ids(record)
+        cache_key, cached = self.get_cached(record)
+        results = self.get_results(record, cached["text"]) if cached is not None else None
+        if results is not None:
+            self.metrics.record_answer(len(ids), len(ids))
+            self.write_results(ids, results)
+            COUNTERS["records_written"] += len(results)
+            logger.info("💾 %s 命中缓存, 已写入 %d 条", ids, len(results))
+            return True
+        for attempt in range(self.max_retries + 1):
+            response = await self.request(record, attempt)
+            results = self.get_results(record, response["text"]) if response is not None else None
+            if response is not None:
+                self.metrics.record_answer(len(ids), len(ids) if results is not None else 0)
+            if results is not None:
+                if cache_key is not None:
+                    self.cache.put(cache_key, response)
+                self.write_results(ids, results)
+                COUNTERS["records_written"] += len(results)
+                logger.info("✅ %s 已写入 %d 条", ids, len(results))
+                return True
+            if attempt < self.max_retries:
+                COUNTERS["retries"] += 1
+                await asyncio.sleep(get_backoff_delay(attempt, self.base_delay, self.max_delay))
+        COUNTERS["failed_prompts"] += 1
+        logger.error("❌ %s 重试 %d 次后仍然失败", ids, self.max_retries)
+        return False
+
+    async def process_batch(self, sentences: List[Dict]) -> bool:
+        """
+        Send a batch of test sentences. The answered ids are written; when some ids are missing, they are sent
+        again in two halves. A single sentence without answer is retried with backoff.
+        """
+        record = self.packer.pack_batch(sentences)
+        if self.response_format == "text":
+            # raw answers cannot be checked id by id
+            return await self.process(record)
+        ids = record['ids']
+        cache_key, response = self.get_cached(record)
+        from_cache = response is not None
+        for attempt in range(self.max_retries + 1):
+            if response is None:
+                response = await self.request(record, attempt)
+                if response is None and self.batch_size is not None:
+                    # timeouts and errors on large batches are a reason to shrink them as well
+                    self.batch_size.record(len(ids), False)
+            if response is not None:
+                answered = {}
+                for parsed in self.parse(ids, response["text"]):
+                    if not isinstance(parsed["id"], (list, dict)) and parsed["id"] in record['ids']:
+                        answered.setdefault(parsed["id"], parsed)
+                complete = len(answered) == len(ids)
+                self.metrics.record_answer(len(ids), len(answered))
+                if self.batch_size is not None and not from_cache:
+                    self.batch_size.record(len(ids), complete)
+                if complete and cache_key is not None and not from_cache:
+                    self.cache.put(cache_key, response)
+                if answered:
+                    self.write_results(list(answered), list(answered.values()))
+                    COUNTERS["records_written"] += len(answered)
+                    logger.info("%s %s 已写入 %d 条", "💾" if from_cache else "✅", list(answered), len(answered))
+                if complete:
+                    return True
+                missing = [sent for sent in sentences if sent['id'] not in answered]
+                logger.warning("⚠️ %d/%d 条缺失, 拆分重试", len(missing), len(ids))
+                logger.debug("缺失: %s", [sent['id'] for sent in missing])
+                if answered or len(missing) > 1:
+                    return await self.process_split(missing)
+                response, from_cache = None, False
+            if attempt < self.max_retries:
+                COUNTERS["retries"] += 1
+                await asyncio.sleep(get_backoff_delay(attempt, self.base_delay, self.max_delay))
+        COUNTERS["failed_prompts"] += 1
+        logger.error("❌ %s 重试 %d 次后仍然失败", ids, self.max_retries)
+        return False
+
+    async def process_split(self, sentences: List[Dict]) -> bool:
+        """
+        Send the missing sentences of a batch in two halves, one after the other so that the concurrency stays
+        bounded.
+        """
+        if len(sentences) == 1:
+            return await self.process_batch(sentences)
+        COUNTERS["batch_splits"] += 1
+        middle = len(sentences) // 2
+        first_ok = await self.process_batch(sentences[:middle])
+        second_ok = await self.process_batch(sentences[middle:])
+        return first_ok and second_ok
+
+    def iter_batches(self, test_sentences: Iterable[Dict]) -> Iterator[List[Dict]]:
+        """
+        Group the test sentences in batches that fit the token budget of the packer, of the current adaptive
+        batch size (or max_sentences of the packer).
+        """
+        get_max_sentences = self.batch_size.get if self.batch_size is not None else None
+        for batch, _ in self.packer.get_batches(test_sentences, get_max_sentences):
+            COUNTERS["batches"] += 1
+            yield batch
+
+    def write_results(self, ids: List, results: List[Dict]) -> None:
+        """
+        Write the objects parsed from an answer and journal the ids of the prompt: each id points to the object
+        with the same id, or to the first object of the answer when the LLM changed the ids.
+        """
+        offsets = {}
+        first = None
+        for parsed in results:
+            location = self.writer.write(parsed)
+            first = first or location
+            offsets.setdefault(parsed.get("id") if isinstance(parsed.get("id"), str) else None, location)
+        if self.journal is not None:
+            for sent_id in ids:
+                self.journal.add(sent_id, *offsets.get(sent_id, first))
+
+    def is_completed(self, item) -> bool:
+        if self.journal is None:
+            return False
+        ids = [sent['id'] for sent in item] if isinstance(item, list) else get_record_ids(item)
+        return all(sent_id in self.journal for sent_id in ids)
+
+    async def worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                if isinstance(item, list):
+                    await self.process_batch(item)
+                else:
+                    await self.process(item)
+            finally:
+                queue.task_done()
+
+    async def run(self, items: Iterable) -> None:
+        """
+        Process prompt records, or batches of test sentences.
+        """
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency)]
+        try:
+            for item in items:
+                if self.is_completed(item):
+                    COUNTERS["skipped_completed"] += 1
+                    continue
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            self.writer.close()
+            if self.journal is not None:
+                self.journal.close()
+
+
+def load_train_examples(filepath: str, max_total: int = 60) -> List[Dict]:
+    """
+    Load the first few-shot examples of a .jsonl file, skipping malformed lines.
+    """
+    examples = []
+    with open(filepath, "r", encoding="utf-8") as f:
+        for ligne in f:
+            ligne = ligne.strip()
+            if not ligne or ligne == ',':
+                continue
+            if ligne.endswith(','):
+                ligne = ligne[:-1]
+            try:
+                examples.append(json.loads(ligne))
+            except Exception as e:
+                logger.warning("跳过异常行: %s %s", e, ligne)
+            if len(examples) >= max_total:
+                break
+    return examples
+
+
+def get_prompt_packer(args) -> PromptPacker:
+    """
+    Packer of the test sentences of test_file with the instructions and few-shot examples, as in the notebook.
+    """
+    with open(args.instructions_file, "r", encoding="utf-8") as prompt:
+        instructions = prompt.read()
+    examples = load_train_examples(args.examples_file, args.num_examples) if args.examples_file else []
+    return PromptPacker(instructions, args.token_budget, examples=examples, max_examples=args.num_examples,
+                        max_sentences=args.max_sentences)
+
+
+def iter_test_sentences(test_path: str, journal: CheckpointJournal = None) -> Iterator[Dict]:
+    """
+    Test sentences of a .jsonl file, leaving out those already in the journal.
+    """
+    for test_sentence in iter_jsonl(test_path):
+        if journal is None or test_sentence['id'] not in journal:
+            yield test_sentence
+
+
+def setup_logging(log_level: str = "INFO") -> None:
+    logger.setLevel(log_level.upper())
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Extract triples with an LLM, sending the prompts concurrently")
+    parser.add_argument('--provider', type=str, default="gemini", choices=["gemini", "openai", "llama_cpp", "llama_server", "fake"])
+    parser.add_argument('--model', type=str, default="gemini-2.5-pro-preview-05-06")
+    parser.add_argument('--project', type=str, default=None, help="Vertex AI project of the gemini provider")
+    parser.add_argument('--location', type=str, default="us-central1", help="Vertex AI location")
+    parser.add_argument('--base_url', type=str, default=None, help="base url of an OpenAI compatible server")
+    parser.add_argument('--model_path', type=str, default=None, help="model file of the llama_cpp provider")
+    parser.add_argument('--server_address', type=str, default="127.0.0.1:8765",
+                        help="host:port or Unix socket of the llama_server provider (see llama_server.py)")
+    parser.add_argument('--temperature', type=float, default=None)
+    parser.add_argument('--max_tokens', type=int, default=None, help="maximum number of generated tokens")
+    parser.add_argument('--fake_latency', type=float, default=0.05, help="latency of the fake provider in seconds")
+    parser.add_argument('--fake_failure_rate', type=float, default=0.0)
+
+    parser.add_argument('--prompts', type=str, nargs='*', default=None,
+                        help="prompt files generated by gen_prompt.py (any format)")
+    parser.add_argument('--test_file', type=str, default=None,
+                        help="without --prompts, .jsonl file of test sentences (id, sent)")
+    parser.add_argument('--instructions_file', type=str, default="event_json_to_ttl/prompts/promptSimple.txt")
+    parser.add_argument('--examples_file', type=str, default=None,
+                        help="few-shot examples, e.g. event_json_to_ttl/data/simplified_ground_truth.jsonl")
+    parser.add_argument('--num_examples', type=int, default=60)
+    parser.add_argument('--token_budget', type=int, default=1000000, help="maximum length of the packed prompts")
+    parser.add_argument('--max_sentences', type=int, default=1,
+                        help="test sentences per packed prompt (the maximum, with --adaptive_batching)")
+    parser.add_argument('--adaptive_batching', action='store_true',
+                        help="learn the number of test sentences per prompt from the success rate of the model")
+    parser.add_argument('--batch_state', type=str, default=None,
+                        help="success rates of the batch sizes of each model, kept between runs, "
+                             "by default <output_dir>/batch_sizes.json")
+
+    parser.add_argument('--output_dir', type=str, default="llm_responses")
+    parser.add_argument('--records_per_file', type=int, default=10000)
+    parser.add_argument('--journal', type=str, default=None,
+                        help="checkpoint journal of the written responses, by default "
+                             "<output_dir>/<input>_journal.jsonl; the ids already in the journal are skipped")
+    parser.add_argument('--commit_every', type=int, default=100,
+                        help="number of responses between two fsyncs of the output files and the journal")
+    parser.add_argument('--compact_test_files', type=str, nargs='*', default=None,
+                        help="after the run, merge the responses into one <street>_test_llm_responses.jsonl file per "
+                             "test file (e.g. test/*_test.jsonl) in output_dir")
+    parser.add_argument('--cache', type=str, default=None,
+                        help="SQLite response cache, e.g. llm_responses/cache.sqlite: "
+                             "cached prompts are not sent again")
+    parser.add_argument('--cache_max_mb', type=float, default=1024,
+                        help="size of the cache above which the least recently used responses are evicted")
+    parser.add_argument('--debug_invalid', type=str, default=None,
+                        help="file receiving the malformed JSON fragments of the answers, "
+                             "by default <output_dir>/debug_invalid.json")
+    parser.add_argument('--metrics', type=str, default=None,
+                        help="JSONL stream of the request metrics, by default <output_dir>/<input>_metrics.jsonl")
+    parser.add_argument('--response_format', type=str, default="json", choices=["json", "text"])
+    parser.add_argument('--concurrency', type=int, default=8, help="maximum number of requests in flight")
+    parser.add_argument('--requests_per_minute', type=float, default=None)
+    parser.add_argument('--tokens_per_minute', type=float, default=None, help="limit on the input tokens")
+    parser.add_argument('--max_retries', type=int, default=5)
+    parser.add_argument('--base_delay', type=float, default=1.0, help="first backoff delay in seconds")
+    parser.add_argument('--max_delay', type=float, default=60.0, help="maximum backoff delay in seconds")
+    parser.add_argument('--log_level', type=str.upper, default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args()
+    if not args.prompts and not args.test_file:
+        parser.error("either --prompts or --test_file is required")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be a positive integer")
+    setup_logging(args.log_level)
+
+    input_path = args.prompts[0] if args.prompts else args.test_file
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    os.makedirs(args.output_dir, exist_ok=True)
+    journal_path = args.journal or os.path.join(args.output_dir, f"{base}_journal.jsonl")
+    checkpoint_journal = CheckpointJournal(journal_path, args.commit_every)
+    if len(checkpoint_journal):
+        logger.info("☑️ Reprise: %d ids déjà traités dans %s", len(checkpoint_journal), journal_path)
+    response_cache = ResponseCache(args.cache, int(args.cache_max_mb * (1 << 20))) if args.cache else None
+    invalid_log = InvalidFragmentLog(args.debug_invalid or os.path.join(args.output_dir, "debug_invalid.json"))
+    llm_provider = get_provider(args)
+    prompt_packer = get_prompt_packer(args) if not args.prompts else None
+    if prompt_packer is not None and isinstance(llm_provider, LlamaServerProvider):
+        llm_provider.add_prefix(prompt_packer.instructions + PACKED_EXAMPLES_HEADER)
+    batch_state = args.batch_state or os.path.join(args.output_dir, "batch_sizes.json")
+    model_key = "/".join(str(value) for value in [llm_provider.get_model().get("provider"),
+                                                    llm_provider.get_model().get("model")] if value)
+    adaptive_batch_size = load_batch_sizes(batch_state, model_key, args.max_sentences) \
+        if prompt_packer is not None and args.adaptive_batching else None
+    run_metrics = RunMetrics(args.metrics or os.path.join(args.output_dir, f"{base}_metrics.jsonl"), model_key)
+    runner = LLMRunner(llm_provider, RotatingJsonlWriter(args.output_dir, base, args.records_per_file),
+                       args.concurrency, args.requests_per_minute, args.tokens_per_minute, args.max_retries,
+                       args.base_delay, args.max_delay, args.response_format, checkpoint_journal,
+                       response_cache, invalid_log, prompt_packer, adaptive_batch_size,
+                       run_metrics)
+    if args.prompts:
+        items = (record for prompt_path in args.prompts for record in iter_prompts(prompt_path))
+    else:
+        items = runner.iter_batches(iter_test_sentences(args.test_file, checkpoint_journal))
+    start_time = time.time()
+    try:
+        asyncio.run(runner.run(items))
+    finally:
+        if adaptive_batch_size is not None:
+            save_batch_sizes(batch_state, model_key, adaptive_batch_size)
+            logger.info("📦 Batch size %s: %d", model_key, adaptive_batch_size.get())
+        llm_provider.close()
+        invalid_log.close()
+        if invalid_log.count:
+            logger.warning("⚠️ %d fragments JSON invalides dans %s", invalid_log.count, invalid_log.path)
+        metrics_summary = run_metrics.close()
+        if "latency_p50" in metrics_summary:
+            logger.info("⏱️ Latency: p50=%.3fs, p95=%.3fs, p99=%.3fs, max=%.3fs", metrics_summary["latency_p50"],
+                        metrics_summary["latency_p95"], metrics_summary["latency_p99"], metrics_summary["latency_max"])
+        logger.info("🚀 Throughput: %s sentences/s, %s input tokens/s, %s output tokens/s",
+                    metrics_summary.get("sentences_per_sec"), metrics_summary.get("input_tokens_per_sec"),
+                    metrics_summary.get("output_tokens_per_sec"))
+        if response_cache is not None:
+            logger.info("💾 Cache: %s", ", ".join(f"{key}={value}" for key, value in response_cache.stats().items()))
+            response_cache.close()
+    if args.compact_test_files:
+        test_paths = sorted({path for pattern in args.compact_test_files for path in glob.glob(pattern)})
+        for output_path, written, missing in compact(journal_path, test_paths, args.output_dir):
+            logger.info("☑️ %s: %d responses, %d missing", output_path, written, missing)
+    logger.info("📊 Summary: %s, elapsed=%.1fs", ", ".join(f"{key}={value}" for key, value in COUNTERS.items()),
+                time.time() - start_time)
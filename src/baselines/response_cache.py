@@ -0,0 +1,127 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+# Number of hits whose access time is kept in memory before being written to the cache
+ACCESS_FLUSH_EVERY = 1000
+
+
+def get_cache_key(model: Dict, prompt: str) -> str:
+    """
+    Key of a response: sha256 of the model with its decoding params (provider, model name, temperature...)
+    and of the prompt.
+    """
+    payload = json.dumps([model, prompt], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Disk-backed cache of the LLM responses in a SQLite file, so that re-running an experiment with the same
+    prompts, few-shot examples and model does not query the model again.
+    The cache is bounded by max_bytes: when the total size of the responses exceeds it, the least recently used
+    responses are evicted. hits, misses and evictions are counted for the run summary.
+    The access times of the hits are buffered and written in one transaction at the next put, every
+    ACCESS_FLUSH_EVERY hits and at close, so that a read does not write to the database.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> last access time of the hits not written yet
+        self.accessed = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.accessed[key] = time.time()
+        if len(self.accessed) >= ACCESS_FLUSH_EVERY:
+            self.flush_accesses()
+        return json.loads(row[0])
+
+    def flush_accesses(self) -> None:
+        if not self.accessed:
+            return
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                [(access_time, key) for key, access_time in self.accessed.items()])
+        self.accessed = {}
+
+    def put(self, key: str, response: Dict) -> None:
+        value = json.dumps(response, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self.flush_accesses()
+        self.accessed.pop(key, None)
+        row = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.db.execute("INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                        (key, value, size, time.time()))
+        self.size += size - (row[0] if row else 0)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Delete the least recently used responses until the cache is back under 90% of max_bytes,
+        so that eviction does not run again at each put.
+        """
+        target = self.max_bytes * 0.9
+        self.flush_accesses()
+        evicted = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if self.size <= target:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self),
+                "size": self.size}
+
+    def close(self) -> None:
+        self.flush_accesses()
+        self.db.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Show the content of an LLM response cache, or empty it")
+    parser.add_argument('--cache', type=str, required=True)
+    parser.add_argument('--clear', action='store_true')
+    args = parser.parse_args()
+
+    response_cache = ResponseCache(args.cache)
+    if args.clear:
+        response_cache.db.execute("DELETE FROM responses")
+        response_cache.db.execute("VACUUM")
+        response_cache.size = 0
+    print(json.dumps(response_cache.stats()))
+    response_cache.close()
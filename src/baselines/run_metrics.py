@@ -0,0 +1,140 @@
+import argparse
+import json
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+# Upper bounds (in seconds) of the buckets of the latency histogram
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, float("inf")]
+
+
+def get_latency_histogram(latencies: List[float]) -> Dict[str, int]:
+    """
+    Number of latencies per bucket, e.g. {"<=0.5": 3, "<=1": 10, ..., "<=inf": 0}
+    """
+    counts = np.histogram(latencies, bins=[0] + LATENCY_BUCKETS)[0] if latencies else [0] * len(LATENCY_BUCKETS)
+    return {f"<={bound:g}": int(count) for bound, count in zip(LATENCY_BUCKETS, counts)}
+
+
+class RunMetrics:
+    """
+    Instrumentation of an extraction run: every request (latency, prompt and completion tokens, batch size,
+    attempt, success) and every cache lookup is appended to a JSONL metrics stream, and summarize() gives the
+    latency percentiles, the throughput in tokens and sentences per second and the distribution of the batch sizes.
+    Every event carries the id of the run, so that runs appended to the same stream can be told apart.
+    """
+
+    def __init__(self, stream_path: str = None, provider: str = None):
+        self.stream_path = stream_path
+        self.provider = provider
+        self.out_file = open(stream_path, "a", encoding="utf-8") if stream_path else None
+        self.run_id = uuid.uuid4().hex[:12]
+        self.start_time = time.time()
+        self.latencies = []
+        self.counters = Counter()
+        self.batch_sizes = Counter()
+
+    def emit(self, event: Dict) -> None:
+        if self.out_file is not None:
+            self.out_file.write(json.dumps({"time": round(time.time(), 3), "run": self.run_id, **event},
+                                           ensure_ascii=False) + "\n")
+
+    def record_request(self, latency: float, batch_size: int, attempt: int, ok: bool, input_tokens: int = None,
+                       output_tokens: int = None) -> None:
+        """
+        Record a request sent to the provider; ok is False when the request failed (the validity of the answer is
+        recorded separately with record_answer).
+        """
+        self.latencies.append(latency)
+        self.batch_sizes[batch_size] += 1
+        self.counters["requests"] += 1
+        self.counters["failed_requests"] += not ok
+        self.counters["retries"] += attempt > 0
+        self.counters["input_tokens"] += input_tokens or 0
+        self.counters["output_tokens"] += output_tokens or 0
+        self.emit({"event": "request", "provider": self.provider, "latency": round(latency, 4),
+                   "batch_size": batch_size, "attempt": attempt, "ok": ok, "input_tokens": input_tokens,
+                   "output_tokens": output_tokens})
+
+    def record_answer(self, batch_size: int, answered: int) -> None:
+        """
+        Record the number of test sentences of a batch found in an answer (from the provider or the cache).
+        """
+        self.counters["answers"] += 1
+        self.counters["incomplete_answers"] += answered < batch_size
+        self.counters["sentences"] += answered
+        self.emit({"event": "answer", "batch_size": batch_size, "answered": answered})
+
+    def record_cache(self, hit: bool) -> None:
+        self.counters["cache_hits" if hit else "cache_misses"] += 1
+        self.emit({"event": "cache", "hit": hit})
+
+    def summarize(self) -> Dict:
+        elapsed = time.time() - self.start_time
+        latencies = np.array(self.latencies)
+        summary = {"provider": self.provider, "elapsed": round(elapsed, 3), **self.counters}
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            summary.update({"latency_mean": round(float(latencies.mean()), 4), "latency_p50": round(float(p50), 4),
+                            "latency_p95": round(float(p95), 4), "latency_p99": round(float(p99), 4),
+                            "latency_max": round(float(latencies.max()), 4)})
+        summary["latency_histogram"] = get_latency_histogram(self.latencies)
+        summary["batch_sizes"] = {str(size): count for size, count in sorted(self.batch_sizes.items())}
+        if elapsed > 0:
+            summary["input_tokens_per_sec"] = round(self.counters["input_tokens"] / elapsed, 2)
+            summary["output_tokens_per_sec"] = round(self.counters["output_tokens"] / elapsed, 2)
+            summary["sentences_per_sec"] = round(self.counters["sentences"] / elapsed, 3)
+        return summary
+
+    def close(self) -> Dict:
+        """
+        Append the summary to the metrics stream and close it.
+        """
+        summary = self.summarize()
+        self.emit({"event": "summary", **summary})
+        if self.out_file is not None:
+            self.out_file.close()
+            self.out_file = None
+        return summary
+
+
+def summarize_stream(stream_path: str) -> Dict:
+    """
+    Summary of the requests of a metrics stream (possibly of several runs appended to the same file).
+    The elapsed time is the sum of the durations of the runs, so that the time between two runs does not lower
+    the throughput. Runs are told apart by their id and, in streams written without run ids, by their summary.
+    """
+    metrics = RunMetrics()
+    # (run id, number of summaries before the run) -> [first time, last time] of the run
+    spans = {}
+    summaries = 0
+    with open(stream_path, "r", encoding="utf-8") as in_file:
+        for line in in_file:
+            event = json.loads(line)
+            span = spans.setdefault((event.get("run"), summaries), [event["time"] - event.get("latency", 0), None])
+            span[1] = event["time"]
+            if event["event"] == "summary":
+                summaries += 1
+            elif event["event"] == "request":
+                metrics.provider = event.get("provider")
+                metrics.record_request(event["latency"], event["batch_size"], event["attempt"], event["ok"],
+                                       event.get("input_tokens"), event.get("output_tokens"))
+            elif event["event"] == "answer":
+                metrics.record_answer(event["batch_size"], event["answered"])
+            elif event["event"] == "cache":
+                metrics.record_cache(event["hit"])
+    metrics.start_time = time.time() - sum(last_time - first_time for first_time, last_time in spans.values())
+    return metrics.summarize()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Summarize the metrics stream of LLM runs, e.g. to compare providers")
+    parser.add_argument('streams', type=str, nargs='+', help="metrics .jsonl files written by llm_runner.py")
+    args = parser.parse_args()
+
+    for path in args.streams:
+        print(json.dumps({"stream": path, **summarize_stream(path)}, ensure_ascii=False))
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from json_stream import iter_json_objects, parse_json_objects
+
+ANSWERS = [
+    '{"id":"2","s":"br{ace}\\" q"}',
+    '{"a": "\\u00e9\\"}"}',
+    '```json\n{"id": "1", "triples": [["a", "b", "c"]]}\n{"id": "2", "triples": []}\n```',
+    'Voici la réponse : [{"id": "1", "x": {"y": "\\\\"}}, {"id": "2", "x": "}{"}] fin.',
+    '{"id": "1", "s": "ok"}\n{"id": "2", "s": "tronqué',
+    '{"id": "1", "s": bad}\n{"id": "2", "s": "\\\\\\""}',
+]
+
+
+def parse_chunks(chunks):
+    invalid = []
+    objects = list(iter_json_objects(chunks, lambda fragment, error: invalid.append(fragment)))
+    return objects, invalid
+
+
+@pytest.mark.parametrize("text", ANSWERS)
+def test_split_at_every_offset_with_empty_chunks(text):
+    """
+    An answer streamed in chunks, including the empty deltas of streaming APIs, gives the same objects and
+    invalid fragments as the whole answer, wherever it is split.
+    """
+    expected = parse_chunks([text])
+    for k in range(len(text) + 1):
+        assert parse_chunks([text[:k], "", text[k:]]) == expected, k
+        assert parse_chunks(["", text[:k], "", "", text[k:], ""]) == expected, k
+
+
+@pytest.mark.parametrize("text", ANSWERS)
+def test_one_character_per_chunk(text):
+    expected = parse_chunks([text])
+    assert parse_chunks([part for char in text for part in (char, "")]) == expected
+
+
+def test_escaped_quote_split_before_empty_chunk():
+    text = '{"id":"2","s":"br{ace}\\" q"}'
+    k = text.index('\\"') + 1
+    assert list(iter_json_objects([text[:k], "", text[k:]])) == [json.loads(text)]
+
+
+def test_parse_json_objects():
+    assert parse_json_objects(ANSWERS[2]) == [{"id": "1", "triples": [["a", "b", "c"]]}, {"id": "2", "triples": []}]
@@ -60,15 +60,11 @@ for i in range(len(sentences)):
     #propmt sent to the LLM
     start_time = time.time()
     # max_tokens = 512 for alpaca model if you surpass this limit you will get an error
-    output = llm(prompt_sentence, max_tokens=250, echo=True, temperature=0)
+    # echo=False: only the completion comes back, no need to search for the answer in the prompt
+    # (see llama_server.py to keep the model loaded between runs)
+    output = llm(prompt_sentence, max_tokens=250, echo=False, temperature=0)
     end_time = time.time()
     print(f"Query LLM loading time: {end_time - start_time}")
     text = output["choices"][0]["text"]
-
-    #Extract the answer from the output
-    start_pos = text.find("Give the correct answer\nAnswer:")
-    start_pos = start_pos + len("Give the correct answer\nAnswer:")
-    #print("Question:")
-    #print(text[:start_pos])
-    print(f"Answer: {text[start_pos:]}")
+    print(f"Answer: {text}")
 
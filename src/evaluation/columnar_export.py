@@ -0,0 +1,109 @@
+import os
+from typing import Dict, List, Tuple
+
+from metrics_matrix import METRIC_NAMES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# File extension of each supported columnar format.
+COLUMNAR_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def columnar_path(jsonl_path: str, columnar_format: str) -> str:
+    """
+    Path of the columnar file written next to a per-sentence .jsonl file.
+    """
+    return os.path.splitext(jsonl_path)[0] + COLUMNAR_EXTENSIONS[columnar_format]
+
+
+def constant_dictionary_column(value: str, length: int):
+    """
+    Dictionary-encoded string column repeating a single value, which may be None.
+    """
+    if value is None:
+        return pa.DictionaryArray.from_arrays(pa.nulls(length, pa.int32()), pa.array([], pa.string()))
+    return pa.DictionaryArray.from_arrays(pa.array([0] * length, pa.int32()), pa.array([value], pa.string()))
+
+
+class ColumnarWriter:
+    """
+    Write per-sentence evaluation metrics as a Parquet file or an Arrow IPC file (which can be memory-mapped).
+    Metrics are stored as float64 columns with their raw values, ids, ontologies and systems as
+    dictionary-encoded string columns, along with the number of system, filtered and ground truth triples.
+    Rows are buffered and written in record batches, so the writer can be fed sentence by sentence.
+    """
+
+    def __init__(self, path: str, columnar_format: str = "parquet", onto_id: str = None, system_id: str = None,
+                 batch_size: int = 10000):
+        if pa is None:
+            raise ImportError("pyarrow is required for the columnar export of the evaluation metrics "
+                              "(pip install pyarrow)")
+        self.path = path
+        self.onto_id = onto_id
+        self.system_id = system_id
+        self.batch_size = batch_size
+        self.rows = []
+        # Dictionary of the id column, extended batch after batch (Arrow IPC files only accept dictionary deltas)
+        self.id_indices = {}
+        self.id_values = []
+        self.schema = pa.schema(
+            [("id", pa.dictionary(pa.int32(), pa.string())),
+             ("onto", pa.dictionary(pa.int32(), pa.string())),
+             ("system", pa.dictionary(pa.int32(), pa.string()))] +
+            [(name, pa.float64()) for name in METRIC_NAMES] +
+            [("num_llm_triples", pa.int32()),
+             ("num_filtered_llm_triples", pa.int32()),
+             ("num_gt_triples", pa.int32())])
+        if columnar_format == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema)
+        elif columnar_format == "arrow":
+            self.writer = pa.ipc.new_file(path, self.schema,
+                                          options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        else:
+            raise ValueError(f"Unknown columnar format: {columnar_format}")
+
+    def add(self, eval_metrics: Dict, scores: Tuple) -> None:
+        """
+        Add the per-sentence record and the raw metric values of one sentence.
+        """
+        self.rows.append((eval_metrics, scores))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def add_all(self, results: List[Tuple[Dict, Tuple]]) -> None:
+        for eval_metrics, scores in results:
+            self.add(eval_metrics, scores)
+
+    def flush(self) -> None:
+        """
+        Write the buffered rows as one record batch.
+        """
+        if not self.rows:
+            return
+        id_indices = []
+        for eval_metrics, _ in self.rows:
+            sent_id = str(eval_metrics["id"])
+            if sent_id not in self.id_indices:
+                self.id_indices[sent_id] = len(self.id_values)
+                self.id_values.append(sent_id)
+            id_indices.append(self.id_indices[sent_id])
+        columns = [
+            pa.DictionaryArray.from_arrays(pa.array(id_indices, pa.int32()), pa.array(self.id_values, pa.string())),
+            constant_dictionary_column(self.onto_id, len(id_indices)),
+            constant_dictionary_column(self.system_id, len(id_indices)),
+        ]
+        for i, _ in enumerate(METRIC_NAMES):
+            columns.append(pa.array([float(scores[i]) for _, scores in self.rows], pa.float64()))
+        for field in ["llm_triples", "filtered_llm_triples", "gt_triples"]:
+            columns.append(pa.array([len(eval_metrics[field]) for eval_metrics, _ in self.rows], pa.int32()))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=self.schema))
+        self.rows = []
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
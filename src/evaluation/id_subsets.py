@@ -0,0 +1,83 @@
+import fnmatch
+import os
+import re
+from typing import Dict, Iterable, List, Set
+
+import numpy as np
+
+
+class IdSubset:
+    """
+    Named subset of test sentence ids, given as a file listing ids (one per line) and/or glob or regex patterns
+    over the ids. A glob must match the whole id (e.g. "*_ouverture*"), while a regex may match anywhere in the id
+    (e.g. "ouverture", or "^117" to anchor it). Listed ids are kept in a hashed set and the globs and the regexes
+    are each compiled into a single regex, so membership is tested in constant time for each sentence.
+    """
+
+    def __init__(self, name: str, ids: Iterable[str] = (), globs: Iterable[str] = (), regexes: Iterable[str] = ()):
+        self.name = name
+        self.ids = set(ids)
+        self.globs = list(globs)
+        self.regexes = list(regexes)
+        self.glob_pattern = compile_alternatives([fnmatch.translate(glob) for glob in self.globs])
+        self.regex_pattern = compile_alternatives(self.regexes)
+
+    @classmethod
+    def from_spec(cls, name: str, spec) -> "IdSubset":
+        """
+        Build a subset from its entry in the config: either the path of an id file, or a dictionary with
+        optional "file", "glob" and "regex" entries (each a string or a list of strings).
+        """
+        if isinstance(spec, str):
+            spec = {"file": spec}
+        ids = set()
+        for path in as_list(spec.get("file")):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"id file of the subset {name!r} not found: {path}")
+            ids.update(read_ids(path))
+        return cls(name, ids, as_list(spec.get("glob")), as_list(spec.get("regex")))
+
+    def __contains__(self, sent_id) -> bool:
+        sent_id = str(sent_id)
+        return (sent_id in self.ids
+                or (self.glob_pattern is not None and self.glob_pattern.fullmatch(sent_id) is not None)
+                or (self.regex_pattern is not None and self.regex_pattern.search(sent_id) is not None))
+
+    def mask(self, ids: List[str]) -> np.ndarray:
+        """
+        Bitmap of the subset over a sentence index: True for the positions whose id belongs to the subset.
+        """
+        return np.fromiter((sent_id in self for sent_id in ids), dtype=bool, count=len(ids))
+
+
+def compile_alternatives(patterns: List[str]):
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+
+def as_list(value) -> List[str]:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def read_ids(path: str) -> Set[str]:
+    """
+    Read a file listing one test sentence id per line.
+    """
+    with open(path, "r", encoding="utf-8") as in_file:
+        return {line.strip() for line in in_file if line.strip()}
+
+
+def expand_subset_specs(subsets: Dict, onto: str) -> Dict:
+    """
+    Replace the $$onto$$ placeholder in the file paths of the subsets of the config.
+    """
+    expanded = {}
+    for name, spec in subsets.items():
+        if isinstance(spec, str):
+            spec = {"file": spec}
+        spec = dict(spec)
+        if "file" in spec:
+            spec["file"] = [path.replace("$$onto$$", onto) for path in as_list(spec["file"])]
+        expanded[name] = spec
+    return expanded
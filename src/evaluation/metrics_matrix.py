@@ -0,0 +1,105 @@
+import re
+from typing import Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Metric columns, in the order of the raw metric values returned by run_eval.evaluate_sentence.
+METRIC_NAMES = ["precision", "recall", "f1", "onto_conf", "rel_halluc", "sub_halluc", "obj_halluc"]
+
+# Count columns following the metrics: correct, predicted (filtered) and gold triples used by precision and recall,
+# and raw system triples, the denominator of the conformance and hallucination metrics.
+COUNT_NAMES = ["num_correct", "num_predicted", "num_gold", "num_system_triples"]
+
+COLUMNS = METRIC_NAMES + COUNT_NAMES
+
+# Number of a sentence among the ones of the same event type, at the end of its id (e.g. 11753_ouverture_6).
+SENTENCE_NUMBER_PATTERN = re.compile(r"_\d+$")
+
+
+def event_type_of(sent_id: str) -> Optional[str]:
+    """
+    Event type of a test sentence, encoded after the first underscore of its id, without the number of the sentence
+    when there are several of the same type (e.g. 11970_ouverture -> ouverture, 11753_ouverture_6 -> ouverture).
+    """
+    sent_id = str(sent_id)
+    if "_" not in sent_id:
+        return None
+    return SENTENCE_NUMBER_PATTERN.sub("", sent_id.split("_", 1)[1])
+
+
+class MetricsMatrix:
+    """
+    Metrics of the evaluated sentences of one ontology (or of several, once concatenated):
+    one row per sentence, one column per metric or count of COLUMNS.
+    Averages over any subset of sentences are computed with boolean masks over the rows.
+    """
+
+    def __init__(self, ids: List[str], values):
+        self.ids = list(ids)
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.ids), len(COLUMNS))
+
+    @classmethod
+    def from_results(cls, results: List[Tuple[Dict, Tuple]]) -> "MetricsMatrix":
+        """
+        Build the matrix from (per-sentence record, raw metric values) pairs.
+        """
+        return cls([eval_metrics["id"] for eval_metrics, _ in results], [scores for _, scores in results])
+
+    @classmethod
+    def concatenate(cls, matrices: List["MetricsMatrix"]) -> "MetricsMatrix":
+        ids = [sent_id for matrix in matrices for sent_id in matrix.ids]
+        if not ids:
+            return cls([], [])
+        return cls(ids, np.vstack([matrix.values for matrix in matrices if len(matrix) > 0]))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def mask_ids(self, ids: Collection) -> np.ndarray:
+        """
+        Mask of the rows whose id is in ids (preferably a set).
+        """
+        return np.fromiter((sent_id in ids for sent_id in self.ids), dtype=bool, count=len(self.ids))
+
+    def event_type_masks(self) -> Dict[str, np.ndarray]:
+        """
+        Mask of the rows of each event type, in order of first appearance.
+        """
+        event_types = np.array([event_type_of(sent_id) or "" for sent_id in self.ids], dtype=object)
+        masks = {}
+        for event_type in dict.fromkeys(event_types):
+            if event_type:
+                masks[event_type] = event_types == event_type
+        return masks
+
+    def count(self, mask: np.ndarray = None) -> int:
+        return len(self) if mask is None else int(mask.sum())
+
+    def macro_average(self, mask: np.ndarray = None) -> Optional[np.ndarray]:
+        """
+        Average of the per-sentence metrics over the selected rows, or None when no row is selected.
+        """
+        values = self.values if mask is None else self.values[mask]
+        if len(values) == 0:
+            return None
+        return values[:, :len(METRIC_NAMES)].mean(axis=0)
+
+    def micro_average(self, mask: np.ndarray = None) -> Optional[np.ndarray]:
+        """
+        Metrics of the selected rows pooled at the triple level, or None when no row is selected:
+        precision and recall are computed from the total numbers of correct, predicted and gold triples,
+        and the conformance and hallucination metrics are weighted by the number of system triples.
+        """
+        values = self.values if mask is None else self.values[mask]
+        if len(values) == 0:
+            return None
+        num_correct, num_predicted, num_gold, num_system_triples = values[:, len(METRIC_NAMES):].sum(axis=0)
+        precision = num_correct / num_predicted if num_predicted > 0 else 0
+        recall = num_correct / num_gold if num_gold > 0 else 0
+        f1 = 2 * ((precision * recall) / (precision + recall)) if precision + recall > 0 else 0
+        if num_system_triples > 0:
+            weighted = values[:, 3:len(METRIC_NAMES)].T @ values[:, COLUMNS.index("num_system_triples")]
+            other_metrics = weighted / num_system_triples
+        else:
+            other_metrics = np.zeros(len(METRIC_NAMES) - 3)
+        return np.concatenate([[precision, recall, f1], other_metrics])
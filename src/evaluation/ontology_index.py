@@ -0,0 +1,96 @@
+import json
+import os
+import pickle
+from typing import Dict, List, Optional
+
+# Version of the OntologyIndex layout, stored in the pickles: bump it whenever the index content changes.
+INDEX_VERSION = "1"
+
+
+def normalize_relation(name: str) -> str:
+    """
+    Normalized form of a relation name used in ontology conformance: no underscores, lowercase.
+    """
+    return name.replace("_", "").lower()
+
+
+def relation_local_name(pid: str) -> str:
+    """
+    Local name of a relation id, without its prefix (e.g. addr:hasAttribute -> hasAttribute).
+    """
+    return pid.split(':', 1)[1] if ':' in pid else pid
+
+
+class OntologyIndex:
+    """
+    Compiled view of an ontology file (as produced in ontology_to_json), built once per ontology and shared by
+    the evaluation and the prompt generation:
+        - concept_labels: qid -> label of the concepts
+        - relation_names: normalized local names of the relations (plus "label"), for ontology conformance
+        - domains / ranges: relation pid -> qid of its domain / range concept
+        - concept_text: the concept labels joined by spaces, stemmed in hallucination detection
+        - verbalized_concepts / verbalized_relations: the concept and relation lists included in the prompts
+    The parsed ontology itself is kept in the ontology attribute.
+    """
+
+    def __init__(self, ontology: Dict):
+        self.ontology = ontology
+        concepts = ontology.get('concepts', [])
+        relations = ontology.get('relations', [])
+
+        self.concept_labels = {}
+        for concept in concepts:
+            # The first concept of a qid wins, as with a linear scan
+            self.concept_labels.setdefault(concept['qid'], concept['label'])
+
+        self.relation_names = {normalize_relation(relation_local_name(rel.get('pid', ''))) for rel in relations}
+        self.relation_names.add("label")
+        self.domains = {rel.get('pid', ''): rel.get('domain') for rel in relations}
+        self.ranges = {rel.get('pid', ''): rel.get('range') for rel in relations}
+
+        self.concept_text = " ".join([c["label"] for c in concepts])
+        self.verbalized_concepts = "".join([c['label'] + ", " for c in concepts])[0:-1]
+        self.verbalized_relations = self.verbalize_relations(relations)
+
+    def concept_label(self, qid: str) -> Optional[str]:
+        """
+        Label of a concept, or None when the qid is not a concept of the ontology.
+        """
+        return self.concept_labels.get(qid)
+
+    def verbalize_relations(self, relations: List[Dict]) -> str:
+        """
+        Verbalized list of the relations with their domain and range labels,
+        e.g. cast_member(film,human), director(film,human), ...
+        """
+        ont_rels = []
+        for rel in relations:
+            if rel['label'] is None:
+                continue
+            ont_rel = rel['label'].replace(" ", "_")
+            ont_domain = self.concept_label(rel['domain']) or ""
+            ont_range = self.concept_label(rel['range']) or ""
+            ont_rels.append(f"{ont_rel}({ont_domain},{ont_range})")
+        return ", ".join(ont_rels)
+
+    @classmethod
+    def load(cls, ontology_path: str, use_pickle: bool = False) -> "OntologyIndex":
+        """
+        Build the index of an ontology file. With use_pickle, the index is stored as a pickle next to the
+        ontology file (rue_mizon_ontology.json -> rue_mizon_ontology.pkl) and loaded from it as long as it is
+        newer than the ontology file.
+        """
+        pickle_path = os.path.splitext(ontology_path)[0] + ".pkl"
+        if use_pickle and os.path.exists(pickle_path) and \
+                os.path.getmtime(pickle_path) >= os.path.getmtime(ontology_path):
+            with open(pickle_path, "rb") as in_file:
+                version, index = pickle.load(in_file)
+            if version == INDEX_VERSION:
+                return index
+
+        with open(ontology_path, "r", encoding="utf-8") as in_file:
+            index = cls(json.load(in_file))
+        if use_pickle:
+            with open(pickle_path, "wb") as out_file:
+                pickle.dump((INDEX_VERSION, index), out_file, protocol=pickle.HIGHEST_PROTOCOL)
+        return index
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+
+
+def hash_json(data) -> str:
+    """
+    Content hash of a json-serializable object, independent of the key order of its dictionaries.
+    """
+    serialized = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def result_key(gt_entry: Dict, system_entry: Dict, ontology_hash: str, metric_version: str) -> str:
+    """
+    Key of the evaluation result of one test sentence: it changes as soon as the ground truth entry,
+    the system entry, the ontology or the version of the metrics changes.
+    """
+    return hash_json([gt_entry, system_entry, ontology_hash, metric_version])
+
+
+class ResultCache:
+    """
+    Persistent, content-addressed cache of per-sentence evaluation results, stored in a SQLite file.
+    Each value is the per-sentence record written to the output file and the raw metric values of the sentence,
+    so that the averages can be rebuilt from cached sentences exactly as from freshly evaluated ones.
+    """
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.commit()
+
+    def get_many(self, keys: Iterable[str], batch_size: int = 500) -> Dict[str, Tuple[Dict, Tuple]]:
+        """
+        Look up several keys at once. Returns a dictionary with the keys found in the cache.
+        """
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(f"SELECT key, value FROM results WHERE key IN ({placeholders})", batch)
+            for key, value in rows:
+                cached = json.loads(value)
+                found[key] = (cached["row"], tuple(cached["scores"]))
+        return found
+
+    def get(self, key: str) -> Tuple[Dict, Tuple]:
+        """
+        Look up a single key. Returns None when it is not in the cache.
+        """
+        return self.get_many([key]).get(key)
+
+    def put_many(self, results: List[Tuple[str, Tuple[Dict, Tuple]]]) -> None:
+        """
+        Store (key, (row, scores)) pairs and commit them.
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+            [(key, json.dumps({"row": row, "scores": list(scores)})) for key, (row, scores) in results])
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
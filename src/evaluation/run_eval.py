@@ -1,11 +1,60 @@
 import argparse
+import csv
 import sys
 import os
 import json
+import logging
 import re
-from typing import List, Dict, Set, Tuple
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Set, Tuple, Iterable, Iterator, Optional
 from nltk.tokenize import word_tokenize
 from nltk.stem import PorterStemmer
+import numpy as np
+from result_cache import ResultCache, hash_json, result_key
+from columnar_export import COLUMNAR_EXTENSIONS, ColumnarWriter, columnar_path
+import columnar_export
+from metrics_matrix import MetricsMatrix
+from id_subsets import IdSubset, expand_subset_specs
+from ontology_index import OntologyIndex, normalize_relation
+
+# Version of the metrics, part of the result cache keys: bump it whenever the scoring of a sentence changes.
+METRIC_VERSION = "2"
+
+# Metric columns of the average rows.
+AVG_METRIC_NAMES = ["avg_precision", "avg_recall", "avg_f1", "avg_onto_conf", "avg_sub_halluc", "avg_rel_halluc",
+                    "avg_obj_halluc"]
+
+# Number of new results written at once to the result cache in streaming mode.
+CACHE_WRITE_BATCH = 1000
+
+# Maximum number of entries of each of the memoized stemming functions.
+STEM_CACHE_SIZE = 100000
+
+# Stemmer shared by all evaluations of a process, so that the stemming caches are reused across shards.
+DEFAULT_STEMMER = PorterStemmer()
+
+# Entity UUIDs (e.g., LM_xxx, EV_xxx) skipped in hallucination detection.
+UUID_PATTERN = re.compile(r"^(LM|EV|CG|ATTR|AV|LMR)_[0-9a-f]{32}$")
+
+# Entity UUIDs reduced to their prefix when comparing triples.
+UUID_PREFIX_PATTERN = re.compile(r"^(LM|EV|CG|ATTR|AV|LMR)_[0-9a-f\-]{32,}$")
+
+logger = logging.getLogger("run_eval")
+
+# Counters reported at the end of the run (sentences evaluated, skipped sentences, warnings...)
+COUNTERS = Counter()
+
+# Counters always reported in the summary, even when they are zero.
+SUMMARY_COUNTERS = ("sentences_evaluated", "skipped_missing_gt", "skipped_missing_sys",
+                    "warnings_f1_without_hallucination")
+
+# Separators removed from labels before comparison.
+SEPARATOR_PATTERN = re.compile(r"(_|\s+)")
+
+# Fast path of SEPARATOR_PATTERN for ASCII labels: deletes "_" and the ASCII characters matched by \s.
+SEPARATOR_TABLE = str.maketrans("", "", "_" + "".join(chr(c) for c in range(128) if chr(c).isspace()))
 
 
 def calculate_precision_recall_f1(gold: Set, pred: Set) -> (float, float, float):
@@ -26,18 +75,17 @@ def calculate_precision_recall_f1(gold: Set, pred: Set) -> (float, float, float)
     return p, r, f1
 
 
-def get_subject_object_hallucinations(ps, ontology, test_sentence, triples) -> (float, float):
+def get_subject_object_hallucinations(ps, ontology, test_sentence, triples, stemmed_concepts: str = None) -> (float, float):
     """
     Calculate subject and object hallucination metrics. UUIDs (e.g., LM_xxx, EV_xxx) are skipped.
+    stemmed_concepts is the output of stem_ontology_concepts for the ontology; it is computed when not given.
     """
     if len(triples) == 0:
         return 0, 0
 
-    test_sentence += " ".join([c["label"] for c in ontology['concepts']])
-    stemmed_sentence = "".join([ps.stem(word) for word in word_tokenize(test_sentence)])
-    normalized_stemmed_sentence = re.sub(r"(_|\s+)", "", stemmed_sentence).lower()
-
-    uuid_pattern = re.compile(r"^(LM|EV|CG|ATTR|AV|LMR)_[0-9a-f]{32}$")
+    if stemmed_concepts is None:
+        stemmed_concepts = stem_ontology_concepts(ps, ontology)
+    normalized_stemmed_sentence = stem_and_normalize(ps, test_sentence) + stemmed_concepts
 
     num_subj_hallucinations = 0
     num_obj_hallucinations = 0
@@ -48,12 +96,12 @@ def get_subject_object_hallucinations(ps, ontology, test_sentence, triples) -> (
         subj_str = "" if subj is None else str(subj)
         obj_str = "" if obj is None else str(obj)
 
-        if uuid_pattern.match(subj_str):
+        if UUID_PATTERN.match(subj_str):
             normalized_stemmed_subject = None
         else:
             normalized_stemmed_subject = clean_entity_string(ps, subj_str)
 
-        if uuid_pattern.match(obj_str):
+        if UUID_PATTERN.match(obj_str):
             normalized_stemmed_object = None
         else:
             normalized_stemmed_object = clean_entity_string(ps, obj_str)
@@ -71,71 +119,132 @@ def get_subject_object_hallucinations(ps, ontology, test_sentence, triples) -> (
     return subj_hallucination, obj_hallucination
 
 
-def get_ontology_conformance(ontology: Dict, triples: List) -> (float, float):
+def get_ontology_conformance(ontology: OntologyIndex, triples: List) -> (float, float):
     """
     Calculate ontology conformance and relation hallucination metrics.
     """
     if len(triples) == 0:
         return 1, 0
 
-    ont_rels_raw = []
-    for rel in ontology.get('relations', []):
-        pid = rel.get('pid', '')
-        if ':' in pid:
-            local_name = pid.split(':', 1)[1]
-        else:
-            local_name = pid
-        ont_rels_raw.append(local_name)
-
-    ont_rels_norm = {r.replace("_", "").lower() for r in ont_rels_raw}
-    ont_rels_norm.add("label")
-
     system_rels_raw = [
         tr[1] for tr in triples
         if isinstance(tr, (list, tuple)) and len(tr) > 1
     ]
-    system_rels_norm = [r.replace("_", "").lower() for r in system_rels_raw]
+    system_rels_norm = [normalize_relation(r) for r in system_rels_raw]
 
-    num_rels_conformant = sum(1 for rel_norm in system_rels_norm if rel_norm in ont_rels_norm)
+    num_rels_conformant = sum(1 for rel_norm in system_rels_norm if rel_norm in ontology.relation_names)
 
     ont_conformance = num_rels_conformant / len(triples)
     rel_hallucination = 1 - ont_conformance
     return ont_conformance, rel_hallucination
 
 
+def normalize_label(label) -> str:
+    """
+    Remove underscores and whitespace from a label and lowercase it.
+    ASCII labels, i.e. almost all of them, go through a translation table instead of the regex.
+    """
+    label = "" if label is None else str(label)
+    if label.isascii():
+        return label.translate(SEPARATOR_TABLE).lower()
+    return SEPARATOR_PATTERN.sub('', label).lower()
+
+
+def normalize_entity(label) -> str:
+    """
+    Normalize the subject or object of a triple. If it is a UUID, only keep the prefix.
+    """
+    label = "" if label is None else str(label)
+    m_uuid = UUID_PREFIX_PATTERN.match(label)
+    if m_uuid:
+        return m_uuid.group(1).lower()
+    return normalize_label(label)
+
+
 def normalize_triple(sub_label: str, rel_label: str, obj_label: str) -> str:
     """
     Normalize triples for comparison in precision/recall calculations.
     If subject or object is a UUID, only keep the prefix.
     """
-    sub_label = "" if sub_label is None else str(sub_label)
-    rel_label = "" if rel_label is None else str(rel_label)
-    obj_label = "" if obj_label is None else str(obj_label)
+    return f"{normalize_entity(sub_label)}{normalize_label(rel_label)}{normalize_entity(obj_label)}"
 
-    m_sub = re.match(r"^(LM|EV|CG|ATTR|AV|LMR)_[0-9a-f\-]{32,}$", sub_label)
-    if m_sub:
-        sub_norm = m_sub.group(1).lower()
-    else:
-        sub_norm = re.sub(r"(_|\s+)", '', sub_label).lower()
 
-    rel_norm = re.sub(r"(_|\s+)", '', rel_label).lower()
+def normalize_triples(triples: Iterable) -> List[Optional[Tuple[str, str]]]:
+    """
+    Normalize a whole list of triples in one pass.
+    Returns, for each triple, the normalized relation (used to filter system triples on the ground-truth relations)
+    and the normalized triple key (used in precision/recall calculations), or None for malformed triples.
+    """
+    normalized = []
+    for tr in triples:
+        if not isinstance(tr, (list, tuple)) or len(tr) < 2:
+            normalized.append(None)
+            continue
+        rel_norm = normalize_label(tr[1])
+        obj_norm = normalize_entity(tr[2] if len(tr) > 2 else None)
+        normalized.append((rel_norm, f"{normalize_entity(tr[0])}{rel_norm}{obj_norm}"))
+    return normalized
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem_and_normalize(ps, text: str) -> str:
+    """
+    Tokenize and stem a string, then remove underscores and whitespace and lowercase it.
+    Results are memoized: the same sentences and entity strings come back for every system and triple.
+    """
+    stemmed_text = "".join([ps.stem(word) for word in word_tokenize(text)])
+    return SEPARATOR_PATTERN.sub('', stemmed_text).lower()
 
-    m_obj = re.match(r"^(LM|EV|CG|ATTR|AV|LMR)_[0-9a-f\-]{32,}$", obj_label)
-    if m_obj:
-        obj_norm = m_obj.group(1).lower()
-    else:
-        obj_norm = re.sub(r"(_|\s+)", '', obj_label).lower()
 
-    return f"{sub_norm}{rel_norm}{obj_norm}"
+def stem_ontology_concepts(ps, ontology: OntologyIndex) -> str:
+    """
+    Stemmed and normalized form of the ontology concept labels, appended to the test sentence
+    in hallucination detection. It only depends on the ontology, so it is built once per ontology.
+    """
+    return stem_and_normalize(ps, ontology.concept_text)
 
 
+@lru_cache(maxsize=STEM_CACHE_SIZE)
 def clean_entity_string(ps, entity: str) -> str:
     """
     Clean subject and object strings of triples for hallucination detection.
     """
-    stemmed_entity = "".join([ps.stem(word) for word in word_tokenize(entity)])
-    normalized_stemmed_entity = re.sub(r"(_|\s+)", '', stemmed_entity).lower()
-    return normalized_stemmed_entity.replace("01januari", "")
+    return stem_and_normalize(ps, entity).replace("01januari", "")
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    Format log records as json lines for the --log_file option.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage().strip(),
+        }
+        if hasattr(record, "counters"):
+            entry["counters"] = record.counters
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(log_level: str = "INFO", log_file: str = None) -> None:
+    """
+    Configure the run_eval logger: plain messages on the console and, optionally, json lines in log_file.
+    """
+    logger.setLevel(log_level.upper())
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(console_handler)
+
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setFormatter(JsonLogFormatter())
+        logger.addHandler(file_handler)
 
 
 def read_jsonl(jsonl_path: str, is_json: bool = True) -> List:
@@ -144,7 +253,7 @@ def read_jsonl(jsonl_path: str, is_json: bool = True) -> List:
     """
     data = []
     if not os.path.exists(jsonl_path):
-        print(f"❌ Debug - 文件不存在: {jsonl_path}")
+        logger.error("❌ Debug - 文件不存在: %s", jsonl_path)
         return data
 
     with open(jsonl_path, "r", encoding="utf-8") as in_file:
@@ -156,13 +265,71 @@ def read_jsonl(jsonl_path: str, is_json: bool = True) -> List:
                 try:
                     data.append(json.loads(line))
                 except json.JSONDecodeError as e:
-                    print(f"⚠️ Debug - JSON 解析失败: {e}\n行: {line}")
+                    COUNTERS["json_decode_errors"] += 1
+                    logger.warning("⚠️ Debug - JSON 解析失败: %s\n行: %s", e, line)
             else:
                 data.append(line)
-    print(f"☑️ Debug - 从 {jsonl_path} 读取了 {len(data)} 条记录")
+    logger.info("☑️ Debug - 从 %s 读取了 %d 条记录", jsonl_path, len(data))
     return data
 
 
+def iter_jsonl(jsonl_path: str) -> Iterator[Dict]:
+    """
+    Lazily iterate over the json objects of a .jsonl file, one line at a time.
+    """
+    if not os.path.exists(jsonl_path):
+        logger.error("❌ Debug - 文件不存在: %s", jsonl_path)
+        return
+
+    with open(jsonl_path, "r", encoding="utf-8") as in_file:
+        for line in in_file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                COUNTERS["json_decode_errors"] += 1
+                logger.warning("⚠️ Debug - JSON 解析失败: %s\n行: %s", e, line)
+
+
+def index_jsonl(jsonl_path: str, id_name: str = "id") -> Dict[str, int]:
+    """
+    Build an index mapping the id of each json object of a .jsonl file to the byte offset of its line.
+    As in convert_to_dict, the last line wins when an id appears several times.
+    """
+    index = {}
+    if not os.path.exists(jsonl_path):
+        logger.error("❌ Debug - 文件不存在: %s", jsonl_path)
+        return index
+
+    with open(jsonl_path, "rb") as in_file:
+        offset = 0
+        for line in in_file:
+            line_offset = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                COUNTERS["json_decode_errors"] += 1
+                logger.warning("⚠️ Debug - JSON 解析失败: %s\n行: %s", e, line)
+                continue
+            if isinstance(item, dict) and id_name in item:
+                index[item[id_name]] = line_offset
+    logger.info("☑️ Debug - 为 %s 建立了 %d 个 id 的索引", jsonl_path, len(index))
+    return index
+
+
+def read_jsonl_line(in_file, offset: int) -> Dict:
+    """
+    Read the json object starting at a byte offset of a .jsonl file opened in binary mode.
+    """
+    in_file.seek(offset)
+    return json.loads(in_file.readline())
+
+
 def load_config(eval_config_path: str) -> Dict:
     """
     Load the evaluation configuration file.
@@ -173,18 +340,56 @@ def load_config(eval_config_path: str) -> Dict:
     new_config = dict()
     expanded_onto_list = list()
 
+    # Several systems can be evaluated in one run: their paths are expanded from the $$system$$ placeholder
+    systems = raw_config.get("systems", [])
+    # Named subsets of test sentences, whose averages are reported along with the ones of all the test cases
+    subsets = raw_config.get("subsets", {})
+    if len(systems) > 1:
+        # with a fixed path, each system would overwrite the results of the previous one
+        for key, pattern in [("output", path_patterns.get("output", "")),
+                             ("avg_out_file", raw_config.get("avg_out_file", ""))]:
+            if "$$system$$" not in pattern:
+                raise ValueError(f"{key} must contain $$system$$ to evaluate several systems: {pattern!r}")
+
     for onto in onto_list:
         onto_data = dict()
         onto_data["id"] = onto
         for key in path_patterns:
             onto_data[key] = path_patterns[key].replace("$$onto$$", onto)
+        if subsets:
+            onto_data["subsets"] = expand_subset_specs(subsets, onto)
+        if systems:
+            sys_pattern, output_pattern = onto_data.pop("sys", ""), onto_data.pop("output", "")
+            onto_data["systems"] = [
+                {"id": system,
+                 "sys": sys_pattern.replace("$$system$$", system),
+                 "output": output_pattern.replace("$$system$$", system)}
+                for system in systems
+            ]
         expanded_onto_list.append(onto_data)
 
     new_config["onto_list"] = expanded_onto_list
     new_config["avg_out_file"] = raw_config.get("avg_out_file", "")
+    if systems:
+        new_config["systems"] = [
+            {"id": system, "avg_out_file": new_config["avg_out_file"].replace("$$system$$", system)}
+            for system in systems
+        ]
+        new_config["comparison_out_file"] = raw_config.get("comparison_out_file", "")
     return new_config
 
 
+def get_onto_systems(onto: Dict) -> List[Dict]:
+    """
+    List the systems to evaluate for an ontology entry of the config, each as a copy of the entry with the
+    'sys' and 'output' paths of the system. Single-system configs give the entry itself.
+    """
+    if "systems" not in onto:
+        return [onto]
+    return [dict(onto, system=system["id"], sys=system["sys"], output=system["output"])
+            for system in onto["systems"]]
+
+
 def save_jsonl(data: List, jsonl_path: str) -> None:
     """
     Serialize a list of json objects to a .jsonl file.
@@ -192,7 +397,7 @@ def save_jsonl(data: List, jsonl_path: str) -> None:
     with open(jsonl_path, "w", encoding="utf-8") as out_file:
         for item in data:
             out_file.write(f"{json.dumps(item)}\n")
-    print(f"☑️ Debug - 写入 {len(data)} 条评估结果到 {jsonl_path}")
+    logger.info("☑️ Debug - 写入 %d 条评估结果到 %s", len(data), jsonl_path)
 
 
 def append_jsonl(data: Dict, jsonl_path: str) -> None:
@@ -201,7 +406,7 @@ def append_jsonl(data: Dict, jsonl_path: str) -> None:
     """
     with open(jsonl_path, "a+", encoding="utf-8") as out_file:
         out_file.write(f"{json.dumps(data)}\n")
-    print(f"☑️ Debug - 追加平均指标到 {jsonl_path}: {data}")
+    logger.info("☑️ Debug - 追加平均指标到 %s: %s", jsonl_path, data)
 
 
 def read_json(json_path: str) -> Dict:
@@ -209,11 +414,11 @@ def read_json(json_path: str) -> Dict:
     Read a JSON file into a dictionary.
     """
     if not os.path.exists(json_path):
-        print(f"❌ Debug - JSON 文件不存在: {json_path}")
+        logger.error("❌ Debug - JSON 文件不存在: %s", json_path)
         return {}
     with open(json_path, "r", encoding="utf-8") as in_file:
         content = json.load(in_file)
-    print(f"☑️ Debug - 读取配置/本体 JSON: {json_path}")
+    logger.info("☑️ Debug - 读取配置/本体 JSON: %s", json_path)
     return content
 
 
@@ -222,235 +427,611 @@ def convert_to_dict(data: List[Dict], id_name: str = "id") -> Dict:
     Convert a list of dictionaries into a dictionary keyed by id_name.
     """
     result = {}
+    skipped = 0
     for item in data:
         if id_name in item:
             result[item[id_name]] = item
         else:
-            print(f"⚠️ Debug - 在数据项里找不到字段 '{id_name}'，该项将被跳过: {item}")
-    print(f"☑️ Debug - convert_to_dict 得到 {len(result)} 个键值对 (key 用 {id_name})")
+            skipped += 1
+            logger.debug("⚠️ Debug - 在数据项里找不到字段 '%s'，该项将被跳过: %s", id_name, item)
+    if skipped > 0:
+        COUNTERS["items_without_id"] += skipped
+        logger.warning("⚠️ Debug - %d 个数据项里找不到字段 '%s'，已跳过", skipped, id_name)
+    logger.info("☑️ Debug - convert_to_dict 得到 %d 个键值对 (key 用 %s)", len(result), id_name)
     return result
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--eval_config_path', type=str, required=True)
-    args = parser.parse_args()
+def is_f1_without_hallucination(f1: float, filtered_system_triples: List, subj_hallucination: float,
+                                obj_hallucination: float) -> bool:
+    """
+    Suspicious sentences: some system triples are wrong although none of their subjects or objects is hallucinated.
+    """
+    return f1 < 1 and len(filtered_system_triples) > 0 and subj_hallucination == 0 and obj_hallucination == 0
 
-    ps = PorterStemmer()
 
-    eval_config_path = args.eval_config_path
-    if not os.path.exists(eval_config_path):
-        print(f"❌ Evaluation config file is not found in path: {eval_config_path}")
-        sys.exit(1)
+def count_cached_result(eval_metrics: Dict, scores: Tuple) -> None:
+    """
+    Update the counters for a sentence served from the result cache, as evaluate_sentence would have.
+    """
+    COUNTERS["cache_hits"] += 1
+    COUNTERS["sentences_evaluated"] += 1
+    if is_f1_without_hallucination(scores[2], eval_metrics["filtered_llm_triples"], scores[5], scores[6]):
+        COUNTERS["warnings_f1_without_hallucination"] += 1
 
-    eval_inputs = load_config(eval_config_path)
-    print(f"☑️ Debug - 最终装载的 eval_inputs: {json.dumps(eval_inputs, indent=2, ensure_ascii=False)}")
 
-    global_p = global_r = global_f1 = 0
-    global_onto_conf = global_rel_halluc = global_sub_halluc = global_obj_halluc = 0
+def prepare_ground_truth(gt_entry: Dict) -> Dict:
+    """
+    Extract and normalize the ground truth of a test sentence. It does not depend on the system,
+    so it is computed once per sentence and shared by all the evaluated systems.
+    """
+    gt_triples = [[tr['sub'], tr['rel'], tr['obj']] for tr in gt_entry.get('triples', [])]
+    # Every triple is normalized once, the keys serve both the filtering and the scoring
+    normalized_gt_keys = normalize_triples(gt_triples)
+    return {
+        "triples": gt_triples,
+        "sent": gt_entry.get("sent", ""),
+        "relations": {keys[0] for keys in normalized_gt_keys if keys is not None},
+        "keys": {keys[1] for keys in normalized_gt_keys if keys is not None},
+    }
+
+
+def evaluate_sentence(ps, ontology: OntologyIndex, sent_id: str, gt_entry: Dict, system_entry: Dict,
+                      stemmed_concepts: str = None, counters: Counter = None,
+                      prepared_gt: Dict = None) -> Tuple[Dict, Tuple]:
+    """
+    Evaluate the system output of a single test sentence against its ground truth.
+    Returns the per-sentence record written to the output file and the raw metric values
+    (precision, recall, f1, onto_conf, rel_halluc, sub_halluc, obj_halluc) used for the averages, followed by
+    the triple counts used for micro-averaging (see metrics_matrix.COLUMNS).
+    Details are only logged at debug level; counters defaults to the module COUNTERS.
+    prepared_gt is the output of prepare_ground_truth for gt_entry; it is computed when not given.
+    """
+    if counters is None:
+        counters = COUNTERS
+    if prepared_gt is None:
+        prepared_gt = prepare_ground_truth(gt_entry)
+    logger.debug("\n🔸 处理句子 ID: %s", sent_id)
+    gt_triples = prepared_gt["triples"]
+    sentence = prepared_gt["sent"]
+    logger.debug("    📜 Ground-truth triples: %s", gt_triples)
+    logger.debug("    📖 原始句子: %s", sentence)
+
+    system_triples = system_entry.get('triples', [])
+    logger.debug("    🤖 系统输出 triples (raw): %s", system_triples)
+
+    normalized_system_keys = normalize_triples(system_triples)
+
+    normalized_gt_relations = prepared_gt["relations"]
+    logger.debug("    🔄 Ground-truth 关系 normalize 后: %s", normalized_gt_relations)
+
+    filtered_system_triples = []
+    normalized_system_triples = set()
+    for tr, keys in zip(system_triples, normalized_system_keys):
+        if keys is not None and keys[0] in normalized_gt_relations:
+            filtered_system_triples.append(tr)
+            normalized_system_triples.add(keys[1])
+    logger.debug("    🔹 过滤后 system triples: %s", filtered_system_triples)
+
+    normalized_gt_triples = prepared_gt["keys"]
+    logger.debug("    🔄 系统 triples normalize 后: %s", normalized_system_triples)
+    logger.debug("    🔄 Ground-truth triples normalize 后: %s", normalized_gt_triples)
+
+    precision, recall, f1 = calculate_precision_recall_f1(normalized_gt_triples, normalized_system_triples)
+    logger.debug("    ✅ Precision=%.2f, Recall=%.2f, F1=%.2f", precision, recall, f1)
+
+    #ont_conformance, rel_hallucination = get_ontology_conformance(ontology, system_triples)
+    ont_conformance, rel_hallucination = 0, 0
+
+    logger.debug("    ✅ Ontology conformance=%.2f, Rel hallucination=%.2f", ont_conformance, rel_hallucination)
+
+    subj_hallucination, obj_hallucination = get_subject_object_hallucinations(ps, ontology, sentence, system_triples,
+                                                                              stemmed_concepts)
+    logger.debug("    ✅ Subj hallucination=%.2f, Obj hallucination=%.2f", subj_hallucination, obj_hallucination)
+
+    counters["sentences_evaluated"] += 1
+    if is_f1_without_hallucination(f1, filtered_system_triples, subj_hallucination, obj_hallucination):
+        counters["warnings_f1_without_hallucination"] += 1
+        logger.debug("    🧐 警告: F1 < 1 且没有 sub/obj hallucination！\n      Sent: %s\n      f1: %s\n      sys: %s\n"
+                     "      gt: %s", sentence, f1, filtered_system_triples, gt_triples)
+
+    eval_metrics = {
+        "id": sent_id,
+        "precision": f"{precision:.2f}",
+        "recall": f"{recall:.2f}",
+        "f1": f"{f1:.2f}",
+        "onto_conf": f"{ont_conformance:.2f}",
+        "rel_halluc": f"{rel_hallucination:.2f}",
+        "sub_halluc": f"{subj_hallucination:.2f}",
+        "obj_halluc": f"{obj_hallucination:.2f}",
+        "llm_triples": system_triples,
+        "filtered_llm_triples": filtered_system_triples,
+        "gt_triples": gt_triples,
+        "sent": sentence
+    }
+    scores = (precision, recall, f1, ont_conformance, rel_hallucination, subj_hallucination, obj_hallucination,
+              len(normalized_gt_triples & normalized_system_triples), len(normalized_system_triples),
+              len(normalized_gt_triples), len(system_triples))
+    return eval_metrics, scores
+
+
+def evaluate_shard(ontology: OntologyIndex, items: List[Tuple[str, Dict, List[Optional[Dict]]]],
+                   ps=None) -> Tuple[List[List[Optional[Tuple[Dict, Tuple]]]], Counter]:
+    """
+    Evaluate a list of (sent_id, gt_entry, system_entries) items of one ontology, in order. system_entries
+    holds the entry of each evaluated system, or None for the systems that do not need to be evaluated,
+    and the ground truth of the sentence is prepared once for all of them.
+    This is the unit of work submitted to the process pool, so it uses the process stemmer when none is given,
+    and returns its own counters along with the results so that they can be merged in the main process.
+    """
+    if ps is None:
+        ps = DEFAULT_STEMMER
+    counters = Counter()
+    stemmed_concepts = stem_ontology_concepts(ps, ontology)
+    results = []
+    for sent_id, gt_entry, system_entries in items:
+        prepared_gt = prepare_ground_truth(gt_entry)
+        results.append([
+            None if system_entry is None else
+            evaluate_sentence(ps, ontology, sent_id, gt_entry, system_entry, stemmed_concepts, counters, prepared_gt)
+            for system_entry in system_entries
+        ])
+    return results, counters
+
+
+def split_in_shards(items: List, shard_size: int) -> List[List]:
+    """
+    Split a list into consecutive shards of at most shard_size elements, keeping the original order.
+    """
+    return [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
 
-    for onto in eval_inputs.get('onto_list', []):
-        onto_id = onto.get('id', 'UNKNOWN')
-        print(f"\n🔎 ===== 开始评估本体: {onto_id} =====")
 
-        t_p = t_r = t_f1 = 0
-        t_onto_conf = t_rel_halluc = t_sub_halluc = t_obj_halluc = 0
+def load_ontology_inputs(onto: Dict, systems: List[Dict], ontology_pickle: bool = False
+                         ) -> Tuple[OntologyIndex, List[Tuple[str, Dict]], List[Dict]]:
+    """
+    Load the files of one ontology entry of the config and collect the test sentences having a ground truth.
+    Returns the ontology index, the ordered (sent_id, gt_entry) items and the output of each system by id.
+    """
+    gt_path = onto.get('gt', '')
+    test_path = onto.get('test', '')
 
-        sel_t_p = sel_t_r = sel_t_f1 = 0
-        sel_t_onto_conf = sel_t_rel_halluc = sel_t_sub_halluc = sel_t_obj_halluc = 0
+    system_outputs = []
+    for system in systems:
+        logger.info("☑️ Debug - Loading system output from: %s", system.get('sys', ''))
+        system_outputs.append(convert_to_dict(read_jsonl(system.get('sys', ''))))
+    logger.info("☑️ Debug - Loading ground truth from: %s", gt_path)
+    ground_list = read_jsonl(gt_path)
+    logger.info("☑️ Debug - Loading test set from: %s", test_path)
+    test_list = read_jsonl(test_path)
 
-        eval_metrics_list = []
+    ground_truth = convert_to_dict(ground_list)
+    test_sentences = convert_to_dict(test_list, id_name="id")
 
-        sys_path = onto.get('sys', '')
-        gt_path = onto.get('gt', '')
-        test_path = onto.get('test', '')
+    ontology = OntologyIndex.load(onto.get('onto', ''), ontology_pickle)
 
-        print(f"☑️ Debug - Loading system output from: {sys_path}")
-        system_list = read_jsonl(sys_path)
-        print(f"☑️ Debug - Loading ground truth from: {gt_path}")
-        ground_list = read_jsonl(gt_path)
-        print(f"☑️ Debug - Loading test set from: {test_path}")
-        test_list = read_jsonl(test_path)
+    items = []
+    for sent_id in list(test_sentences.keys()):
+        # 如果没有 ground truth，跳过
+        if sent_id not in ground_truth:
+            COUNTERS["skipped_missing_gt"] += 1
+            continue
+        items.append((sent_id, ground_truth[sent_id]))
 
-        system_output = convert_to_dict(system_list)
-        ground_truth = convert_to_dict(ground_list)
-        test_sentences = convert_to_dict(test_list, id_name="id")
+    return ontology, items, system_outputs
 
-        onto_path = onto.get('onto', '')
-        ontology = read_json(onto_path)
 
-        if 'selected_ids' in onto:
-            selected_ids = read_jsonl(onto['selected_ids'], is_json=False)
-            print(f"☑️ Debug - selected_ids 列表: {selected_ids}")
-        else:
-            selected_ids = []
-            print(f"☑️ Debug - 没有提供 selected_ids，跳过此环节")
+def average_metrics_row(key: str, key_value: str, avg_type: str, averages, averaging: str = "macro") -> Dict:
+    """
+    Build a row of the avg_out_file from the average metrics of a set of test sentences.
+    Micro-averaged rows are marked with "averaging": "micro".
+    """
+    a_p, a_r, a_f1, a_onto_conf, a_rel_halluc, a_sub_halluc, a_obj_halluc = averages
+    row = {key: key_value, "type": avg_type}
+    if averaging != "macro":
+        row["averaging"] = averaging
+    row.update({
+        "avg_precision": f"{a_p:.2f}",
+        "avg_recall":    f"{a_r:.2f}",
+        "avg_f1":        f"{a_f1:.2f}",
+        "avg_onto_conf": f"{a_onto_conf:.2f}",
+        "avg_sub_halluc":f"{a_sub_halluc:.2f}",
+        "avg_rel_halluc":f"{a_rel_halluc:.2f}",
+        "avg_obj_halluc":f"{a_obj_halluc:.2f}"
+    })
+    return row
+
+
+def load_selected_ids(onto: Dict) -> Set[str]:
+    """
+    Load the optional list of selected (e.g. manually validated) test sentence ids of an ontology.
+    """
+    if 'selected_ids' not in onto:
+        logger.info("☑️ Debug - 没有提供 selected_ids，跳过此环节")
+        return set()
+    selected_ids = read_jsonl(onto['selected_ids'], is_json=False)
+    logger.debug("☑️ Debug - selected_ids 列表: %s", selected_ids)
+    return set(selected_ids)
+
+
+def load_id_subsets(onto: Dict) -> List[IdSubset]:
+    """
+    Load the named subsets of test sentences of an ontology, in config order.
+    """
+    id_subsets = [IdSubset.from_spec(name, spec) for name, spec in onto.get('subsets', {}).items()]
+    for id_subset in id_subsets:
+        logger.debug("☑️ Debug - subset %s: %d ids, %d globs, %d regexes", id_subset.name, len(id_subset.ids),
+                     len(id_subset.globs), len(id_subset.regexes))
+    return id_subsets
 
-        total_test_cases = len(test_sentences)
-        total_selected_test_cases = len(selected_ids)
 
-        # 新增：统计实际上参与评估的测试句子数
-        evaluated_count = 0
-        evaluated_selected_count = 0
+def write_ontology_results(onto: Dict, results: List[Tuple[Dict, Tuple]],
+                           columnar_format: str = None) -> MetricsMatrix:
+    """
+    Write the per-sentence results of one ontology and return their metrics matrix, used for the averages.
+    With a columnar_format, the per-sentence metrics are also written as a columnar file next to the output file.
+    """
+    # 写 per-sentence 评估结果
+    output_path = onto.get('output', '')
+    save_jsonl([eval_metrics for eval_metrics, _ in results], output_path)
+    if columnar_format:
+        columnar_writer = ColumnarWriter(columnar_path(output_path, columnar_format), columnar_format,
+                                         onto.get('id', 'UNKNOWN'), onto.get('system'))
+        columnar_writer.add_all(results)
+        columnar_writer.close()
 
-        for sent_id in list(test_sentences.keys()):
-            # 如果没有 ground truth，跳过
-            if sent_id not in ground_truth:
-                continue
-            # 如果没有系统输出，跳过
-            if sent_id not in system_output:
+    return MetricsMatrix.from_results(results)
+
+
+def evaluate_ontology_streaming(ps, onto: Dict, cache: ResultCache = None, columnar_format: str = None,
+                                ontology_pickle: bool = False) -> MetricsMatrix:
+    """
+    Evaluate one ontology without loading its files in memory: only id -> offset indexes of the ground truth
+    and test files are kept, the system output is read lazily and each per-sentence result is written as soon
+    as it is computed. Sentences are evaluated in the order of the system output; when an id appears several
+    times in the system output, only its first occurrence is evaluated.
+    Sentences found in the result cache, if any, are not evaluated again.
+    With a columnar_format, the per-sentence metrics are also written as a columnar file next to the output file.
+    Returns the metrics matrix of the evaluated sentences, used for the averages.
+    """
+    onto_id = onto.get('id', 'UNKNOWN')
+    sys_path = onto.get('sys', '')
+    gt_path = onto.get('gt', '')
+
+    logger.info("☑️ Debug - Indexing ground truth: %s", gt_path)
+    gt_index = index_jsonl(gt_path)
+    logger.info("☑️ Debug - Indexing test set: %s", onto.get('test', ''))
+    test_index = index_jsonl(onto.get('test', ''))
+
+    if not os.path.exists(gt_path):
+        # 文件不存在已由 index_jsonl 记录：如内存路径，跳过所有句子
+        COUNTERS["skipped_missing_gt"] += len(test_index)
+        save_jsonl([], onto.get('output', ''))
+        return MetricsMatrix([], [])
+
+    ontology = OntologyIndex.load(onto.get('onto', ''), ontology_pickle)
+    stemmed_concepts = stem_ontology_concepts(ps, ontology)
+    ontology_hash = hash_json(ontology.ontology)
+
+    evaluated_ids = set()
+    # Only the ids and metric values of the evaluated sentences are kept in memory
+    matrix_ids, matrix_values = [], []
+    new_results = []
+
+    output_path = onto.get('output', '')
+    columnar_writer = None
+    if columnar_format:
+        columnar_writer = ColumnarWriter(columnar_path(output_path, columnar_format), columnar_format,
+                                         onto_id, onto.get('system'))
+    with open(gt_path, "rb") as gt_file, open(output_path, "w", encoding="utf-8") as out_file:
+        for system_entry in iter_jsonl(sys_path):
+            sent_id = system_entry.get("id")
+            # 没有 ground truth / 不在测试集 / 已评估过的句子，跳过
+            if sent_id not in gt_index or sent_id not in test_index or sent_id in evaluated_ids:
                 continue
+            evaluated_ids.add(sent_id)
+
+            gt_entry = read_jsonl_line(gt_file, gt_index[sent_id])
+            cached = None
+            if cache is not None:
+                key = result_key(gt_entry, system_entry, ontology_hash, METRIC_VERSION)
+                cached = cache.get(key)
+            if cached is not None:
+                eval_metrics, scores = cached
+                count_cached_result(eval_metrics, scores)
+            else:
+                eval_metrics, scores = evaluate_sentence(ps, ontology, sent_id, gt_entry, system_entry,
+                                                         stemmed_concepts)
+                if cache is not None:
+                    new_results.append((key, (eval_metrics, scores)))
+                    if len(new_results) >= CACHE_WRITE_BATCH:
+                        cache.put_many(new_results)
+                        new_results = []
+            out_file.write(f"{json.dumps(eval_metrics)}\n")
+            if columnar_writer is not None:
+                columnar_writer.add(eval_metrics, scores)
+
+            matrix_ids.append(sent_id)
+            matrix_values.append(scores)
+    logger.info("☑️ Debug - 写入 %d 条评估结果到 %s", len(matrix_ids), output_path)
+    if new_results:
+        cache.put_many(new_results)
+    if columnar_writer is not None:
+        columnar_writer.close()
+
+    # Same skip counters as the in-memory path, which goes through the test set
+    for sent_id in test_index:
+        if sent_id not in gt_index:
+            COUNTERS["skipped_missing_gt"] += 1
+        elif sent_id not in evaluated_ids:
+            COUNTERS["skipped_missing_sys"] += 1
+
+    return MetricsMatrix(matrix_ids, matrix_values)
+
+
+def append_average_rows(key: str, key_value: str, avg_type: str, matrix: MetricsMatrix, mask, avg_out_file: str,
+                        averaging: str = "macro", extra: Dict = None) -> bool:
+    """
+    Append the macro and/or micro averages of the sentences selected by mask to avg_out_file.
+    Returns False when no sentence is selected.
+    """
+    if matrix.count(mask) == 0:
+        return False
+    if averaging in ("macro", "both"):
+        row = average_metrics_row(key, key_value, avg_type, matrix.macro_average(mask))
+        append_jsonl(dict(row, **(extra or {})), avg_out_file)
+    if averaging in ("micro", "both"):
+        row = average_metrics_row(key, key_value, avg_type, matrix.micro_average(mask), "micro")
+        append_jsonl(dict(row, **(extra or {})), avg_out_file)
+    return True
+
+
+def append_ontology_averages(onto_id: str, matrix: MetricsMatrix, selected_ids: Set[str], avg_out_file: str,
+                             averaging: str = "macro", by_event_type: bool = False,
+                             id_subsets: List[IdSubset] = ()):
+    """
+    Append the all_test_cases and selected_test_cases averages of one ontology to avg_out_file, then those of
+    each named subset of id_subsets and of each event type when by_event_type is set.
+    Returns the per-ontology (macro) averages to add to the global ones, or None when nothing was evaluated.
+    """
+    # 用实际参与评估的句子数而不是 total_test_cases 来计算平均指标
+    if not append_average_rows("onto", onto_id, "all_test_cases", matrix, None, avg_out_file, averaging):
+        logger.warning("⚠️ Debug - %s 没有有效的测试案例，无法计算平均指标", onto_id)
 
-            # 既然获得了地面真值和系统输出，就算作一次有效评估
-            evaluated_count += 1
-            if sent_id in selected_ids:
-                evaluated_selected_count += 1
-
-            print(f"\n🔸 处理句子 ID: {sent_id}")
-            gt_entry = ground_truth[sent_id]
-            gt_triples = [[tr['sub'], tr['rel'], tr['obj']] for tr in gt_entry.get('triples', [])]
-            sentence = gt_entry.get("sent", "")
-            print(f"    📜 Ground-truth triples: {gt_triples}")
-            print(f"    📖 原始句子: {sentence}")
-
-            system_triples = system_output[sent_id].get('triples', [])
-            print(f"    🤖 系统输出 triples (raw): {system_triples}")
-
-            normalized_gt_relations = {
-                re.sub(r"(_|\s+)", '', str(tr[1])).lower() for tr in gt_triples
-            }
-            print(f"    🔄 Ground-truth 关系 normalize 后: {normalized_gt_relations}")
-
-            filtered_system_triples = [
-                tr for tr in system_triples
-                if isinstance(tr, (list, tuple)) and len(tr) > 1 and
-                   re.sub(r"(_|\s+)", '', str(tr[1])).lower() in normalized_gt_relations
-            ]
-            print(f"    🔹 过滤后 system triples: {filtered_system_triples}")
-
-            normalized_system_triples = {
-                normalize_triple(tr[0], tr[1], tr[2]) for tr in filtered_system_triples
-            }
-            normalized_gt_triples = {
-                normalize_triple(tr[0], tr[1], tr[2]) for tr in gt_triples
-            }
-            print(f"    🔄 系统 triples normalize 后: {normalized_system_triples}")
-            print(f"    🔄 Ground-truth triples normalize 后: {normalized_gt_triples}")
-
-            precision, recall, f1 = calculate_precision_recall_f1(normalized_gt_triples, normalized_system_triples)
-            print(f"    ✅ Precision={precision:.2f}, Recall={recall:.2f}, F1={f1:.2f}")
-
-            #ont_conformance, rel_hallucination = get_ontology_conformance(ontology, system_triples)
-            ont_conformance, rel_hallucination = 0, 0
-
-            print(f"    ✅ Ontology conformance={ont_conformance:.2f}, Rel hallucination={rel_hallucination:.2f}")
-
-            subj_hallucination, obj_hallucination = get_subject_object_hallucinations(ps, ontology, sentence, system_triples)
-            print(f"    ✅ Subj hallucination={subj_hallucination:.2f}, Obj hallucination={obj_hallucination:.2f}")
-
-            if f1 < 1 and len(filtered_system_triples) > 0 and subj_hallucination == 0 and obj_hallucination == 0:
-                print(f"    🧐 警告: F1 < 1 且没有 sub/obj hallucination！")
-                print(f"      Sent: {sentence}")
-                print(f"      f1: {f1}")
-                print(f"      sys: {filtered_system_triples}")
-                print(f"      gt: {gt_triples}")
-
-            eval_metrics = {
-                "id": sent_id,
-                "precision": f"{precision:.2f}",
-                "recall": f"{recall:.2f}",
-                "f1": f"{f1:.2f}",
-                "onto_conf": f"{ont_conformance:.2f}",
-                "rel_halluc": f"{rel_hallucination:.2f}",
-                "sub_halluc": f"{subj_hallucination:.2f}",
-                "obj_halluc": f"{obj_hallucination:.2f}",
-                "llm_triples": system_triples,
-                "filtered_llm_triples": filtered_system_triples,
-                "gt_triples": gt_triples,
-                "sent": sentence
-            }
-            eval_metrics_list.append(eval_metrics)
-
-            t_p += precision
-            t_r += recall
-            t_f1 += f1
-            t_onto_conf += ont_conformance
-            t_rel_halluc += rel_hallucination
-            t_sub_halluc += subj_hallucination
-            t_obj_halluc += obj_hallucination
-
-            if sent_id in selected_ids:
-                sel_t_p += precision
-                sel_t_r += recall
-                sel_t_f1 += f1
-                sel_t_onto_conf += ont_conformance
-                sel_t_rel_halluc += rel_hallucination
-                sel_t_sub_halluc += subj_hallucination
-                sel_t_obj_halluc += obj_hallucination
-
-        # 写 per-sentence 评估结果
-        output_path = onto.get('output', '')
-        save_jsonl(eval_metrics_list, output_path)
-
-        # 用 evaluated_count 而不是 total_test_cases 来计算平均指标
-        if evaluated_count > 0:
-            average_metrics = {
-                "onto": onto_id,
-                "type": "all_test_cases",
-                "avg_precision": f"{(t_p / evaluated_count):.2f}",
-                "avg_recall":    f"{(t_r / evaluated_count):.2f}",
-                "avg_f1":        f"{(t_f1 / evaluated_count):.2f}",
-                "avg_onto_conf": f"{(t_onto_conf / evaluated_count):.2f}",
-                "avg_sub_halluc":f"{(t_sub_halluc / evaluated_count):.2f}",
-                "avg_rel_halluc":f"{(t_rel_halluc / evaluated_count):.2f}",
-                "avg_obj_halluc":f"{(t_obj_halluc / evaluated_count):.2f}"
-            }
-            append_jsonl(average_metrics, eval_inputs['avg_out_file'])
-            global_p += (t_p / evaluated_count)
-            global_r += (t_r / evaluated_count)
-            global_f1 += (t_f1 / evaluated_count)
-            global_onto_conf += (t_onto_conf / evaluated_count)
-            global_sub_halluc += (t_sub_halluc / evaluated_count)
-            global_rel_halluc += (t_rel_halluc / evaluated_count)
-            global_obj_halluc += (t_obj_halluc / evaluated_count)
+    if not append_average_rows("onto", onto_id, "selected_test_cases", matrix, matrix.mask_ids(selected_ids),
+                               avg_out_file, averaging):
+        logger.info("⚠️ Debug - 没有有效的 selected_ids 测试案例，跳过此部分")
+
+    for id_subset in id_subsets:
+        if not append_average_rows("onto", onto_id, "subset", matrix, id_subset.mask(matrix.ids), avg_out_file,
+                                   averaging, {"subset": id_subset.name}):
+            logger.info("⚠️ Debug - subset %s 没有有效的测试案例，跳过此部分", id_subset.name)
+
+    if by_event_type:
+        for event_type, mask in matrix.event_type_masks().items():
+            append_average_rows("onto", onto_id, "event_type", matrix, mask, avg_out_file, averaging,
+                                {"event_type": event_type})
+
+    return matrix.macro_average()
+
+
+def evaluate_ontologies(ps, onto_list: List[Dict], num_systems: int = 1, workers: int = 1,
+                        shard_size: int = 200, cache: ResultCache = None,
+                        columnar_format: str = None, ontology_pickle: bool = False) -> List[List[MetricsMatrix]]:
+    """
+    Evaluate the ontologies of the config for each system, write their results and return, for each system,
+    the metrics matrix of each ontology in config order. The ground truth, the test set and the ontology are loaded
+    once per ontology and shared by all the systems.
+    With several workers, every ontology is loaded and its sentence shards submitted to the process pool
+    before any result is collected, so the pool works on several ontologies at once.
+    With a result cache, only the sentences missing from the cache are evaluated; the cache is only accessed
+    from the main process.
+    """
+    pending = []
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=setup_logging,
+                                   initargs=(logging.getLevelName(logger.getEffectiveLevel()),))
+    try:
+        for onto in onto_list:
+            logger.info("\n🔎 ===== 开始评估本体: %s =====", onto.get('id', 'UNKNOWN'))
+            systems = get_onto_systems(onto)
+            ontology, gt_items, system_outputs = load_ontology_inputs(onto, systems, ontology_pickle)
+
+            items = []
+            for sent_id, gt_entry in gt_items:
+                system_entries = [system_output.get(sent_id) for system_output in system_outputs]
+                # 如果没有系统输出，跳过
+                COUNTERS["skipped_missing_sys"] += system_entries.count(None)
+                items.append((sent_id, gt_entry, system_entries))
+
+            keys, cached = [], {}
+            if cache is not None:
+                ontology_hash = hash_json(ontology.ontology)
+                keys = [[None if system_entry is None else
+                         result_key(gt_entry, system_entry, ontology_hash, METRIC_VERSION)
+                         for system_entry in system_entries]
+                        for _, gt_entry, system_entries in items]
+                cached = cache.get_many(key for sentence_keys in keys for key in sentence_keys if key is not None)
+                logger.info("☑️ Debug - %d 个句子的评估结果已在缓存中", len(cached))
+
+            to_evaluate = []
+            for i, (sent_id, gt_entry, system_entries) in enumerate(items):
+                if keys:
+                    system_entries = [None if key in cached else system_entry
+                                      for system_entry, key in zip(system_entries, keys[i])]
+                if any(system_entry is not None for system_entry in system_entries):
+                    to_evaluate.append((sent_id, gt_entry, system_entries))
+
+            if pool is None:
+                shards = [evaluate_shard(ontology, to_evaluate, ps)]
+            else:
+                shards = [pool.submit(evaluate_shard, ontology, shard)
+                          for shard in split_in_shards(to_evaluate, shard_size)]
+            pending.append((systems, items, keys, cached, shards))
+
+        all_matrices = [[] for _ in range(num_systems)]
+        for systems, items, keys, cached, shards in pending:
+            evaluated = []
+            for shard in shards:
+                shard_results, shard_counters = shard if pool is None else shard.result()
+                evaluated.extend(shard_results)
+                COUNTERS.update(shard_counters)
+
+            # Put the cached and the evaluated sentences of each system back in test-set order
+            results = [[] for _ in systems]
+            new_results = []
+            evaluated = iter(evaluated)
+            for i, (_, _, system_entries) in enumerate(items):
+                sentence_keys = keys[i] if keys else [None] * len(systems)
+                if any(system_entry is not None and key not in cached
+                       for system_entry, key in zip(system_entries, sentence_keys)):
+                    sentence_results = next(evaluated)
+                for s, (system_entry, key) in enumerate(zip(system_entries, sentence_keys)):
+                    if system_entry is None:
+                        continue
+                    if key in cached:
+                        result = cached[key]
+                        count_cached_result(*result)
+                    else:
+                        result = sentence_results[s]
+                        if key is not None:
+                            new_results.append((key, result))
+                    results[s].append(result)
+            if cache is not None:
+                cache.put_many(new_results)
+
+            for s, system in enumerate(systems):
+                all_matrices[s].append(write_ontology_results(system, results[s], columnar_format))
+        return all_matrices
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def write_comparison_table(rows: List[Dict], csv_path: str) -> None:
+    """
+    Write the averages of all the evaluated systems in a single csv table, one row per system and ontology.
+    """
+    with open(csv_path, "w", encoding="utf-8", newline="") as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=["system", "onto", "type"] + AVG_METRIC_NAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    logger.info("☑️ Debug - 写入 %d 行系统对比结果到 %s", len(rows), csv_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--eval_config_path', type=str, required=True)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes; ontologies and sentence shards are evaluated in parallel when > 1")
+    parser.add_argument('--shard_size', type=int, default=200,
+                        help="number of test sentences per task submitted to the worker processes")
+    parser.add_argument('--stream', action='store_true',
+                        help="evaluate with bounded memory: index the ground truth and test files, read the system "
+                             "output lazily and write the per-sentence metrics incrementally")
+    parser.add_argument('--log_level', '--log-level', type=str.upper, default="INFO",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG prints the details of every evaluated sentence")
+    parser.add_argument('--log_file', '--log-file', type=str, default=None,
+                        help="optional file receiving the log records and the final counters as json lines")
+    parser.add_argument('--cache_path', type=str, default=None,
+                        help="SQLite file caching per-sentence results; unchanged sentences are not evaluated again")
+    parser.add_argument('--columnar_format', type=str, default=None, choices=sorted(COLUMNAR_EXTENSIONS),
+                        help="also write the per-sentence metrics as float columns in a Parquet or Arrow IPC file "
+                             "next to each output file (requires pyarrow)")
+    parser.add_argument('--ontology_pickle', action='store_true',
+                        help="store the compiled index of each ontology as a pickle next to its json file and "
+                             "reuse it in later runs")
+    parser.add_argument('--averaging', type=str, default="macro", choices=["macro", "micro", "both"],
+                        help="macro: average of the per-sentence metrics (default); micro: metrics pooled over "
+                             "all the triples")
+    parser.add_argument('--by_event_type', action='store_true',
+                        help="also report the averages of each event type, taken from the sentence ids "
+                             "(e.g. 11970_ouverture -> ouverture)")
+    args = parser.parse_args()
+
+    setup_logging(args.log_level, args.log_file)
+    ps = DEFAULT_STEMMER
+
+    eval_config_path = args.eval_config_path
+    if not os.path.exists(eval_config_path):
+        logger.error("❌ Evaluation config file is not found in path: %s", eval_config_path)
+        sys.exit(1)
+    if args.workers < 1 or args.shard_size < 1:
+        logger.error("❌ --workers and --shard_size must be positive integers")
+        sys.exit(1)
+    if args.stream and args.workers > 1:
+        logger.error("❌ --stream evaluates in a single process and cannot be combined with --workers")
+        sys.exit(1)
+    if args.columnar_format and columnar_export.pa is None:
+        logger.error("❌ --columnar_format requires pyarrow (pip install pyarrow)")
+        sys.exit(1)
+
+    eval_inputs = load_config(eval_config_path)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("☑️ Debug - 最终装载的 eval_inputs: %s", json.dumps(eval_inputs, indent=2, ensure_ascii=False))
+
+    onto_list = eval_inputs.get('onto_list', [])
+    systems = eval_inputs.get('systems', [{"id": None, "avg_out_file": eval_inputs['avg_out_file']}])
+
+    cache = ResultCache(args.cache_path) if args.cache_path else None
+    try:
+        if args.stream:
+            all_matrices = [[] for _ in systems]
+            for onto in onto_list:
+                logger.info("\n🔎 ===== 开始评估本体: %s =====", onto.get('id', 'UNKNOWN'))
+                for s, system_onto in enumerate(get_onto_systems(onto)):
+                    all_matrices[s].append(evaluate_ontology_streaming(ps, system_onto, cache, args.columnar_format,
+                                                                       args.ontology_pickle))
         else:
-            print(f"⚠️ Debug - 没有有效的测试案例，无法计算平均指标")
-
-        # 用 evaluated_selected_count 计算 selected 平均指标
-        if evaluated_selected_count > 0:
-            selected_average_metrics = {
-                "onto": onto_id,
-                "type": "selected_test_cases",
-                "avg_precision": f"{(sel_t_p / evaluated_selected_count):.2f}",
-                "avg_recall":    f"{(sel_t_r / evaluated_selected_count):.2f}",
-                "avg_f1":        f"{(sel_t_f1 / evaluated_selected_count):.2f}",
-                "avg_onto_conf": f"{(sel_t_onto_conf / evaluated_selected_count):.2f}",
-                "avg_sub_halluc":f"{(sel_t_sub_halluc / evaluated_selected_count):.2f}",
-                "avg_rel_halluc":f"{(sel_t_rel_halluc / evaluated_selected_count):.2f}",
-                "avg_obj_halluc":f"{(sel_t_obj_halluc / evaluated_selected_count):.2f}"
-            }
-            append_jsonl(selected_average_metrics, eval_inputs['avg_out_file'])
+            all_matrices = evaluate_ontologies(ps, onto_list, len(systems), args.workers, args.shard_size,
+                                               cache, args.columnar_format, args.ontology_pickle)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    all_selected_ids = [load_selected_ids(onto) for onto in onto_list]
+    all_id_subsets = [load_id_subsets(onto) for onto in onto_list]
+
+    comparison_rows = []
+    for system, system_matrices in zip(systems, all_matrices):
+        global_totals = np.zeros(7)
+        for onto, matrix, selected_ids, id_subsets in zip(onto_list, system_matrices, all_selected_ids,
+                                                          all_id_subsets):
+            onto_averages = append_ontology_averages(onto['id'], matrix, selected_ids, system["avg_out_file"],
+                                                     args.averaging, args.by_event_type, id_subsets)
+            if onto_averages is not None:
+                global_totals += onto_averages
+                comparison_rows.append(dict(average_metrics_row("onto", onto['id'], "all_test_cases", onto_averages),
+                                            system=system["id"]))
+
+        # 计算并写入全局指标，需除以本体数量
+        num_ontologies = len(onto_list)
+        if num_ontologies > 0:
+            global_averages = global_totals / num_ontologies
+            if args.averaging in ("macro", "both"):
+                global_metrics = average_metrics_row("id", "global", "global", global_averages)
+                global_metrics["onto_list"] = onto_list
+                append_jsonl(global_metrics, system["avg_out_file"])
+            if args.averaging in ("micro", "both"):
+                # Micro-averaged over the triples of all the ontologies
+                global_matrix = MetricsMatrix.concatenate(system_matrices)
+                if len(global_matrix) > 0:
+                    global_metrics = average_metrics_row("id", "global", "global", global_matrix.micro_average(),
+                                                         "micro")
+                    global_metrics["onto_list"] = onto_list
+                    append_jsonl(global_metrics, system["avg_out_file"])
+            comparison_rows.append(dict(average_metrics_row("onto", "global", "global", global_averages),
+                                        system=system["id"]))
         else:
-            print(f"⚠️ Debug - 没有有效的 selected_ids 测试案例，跳过此部分")
-
-    # 计算并写入全局指标，需除以本体数量
-    num_ontologies = len(eval_inputs.get('onto_list', []))
-    if num_ontologies > 0:
-        global_metrics = {
-            "id": "global",
-            "type": "global",
-            "avg_precision": f"{(global_p / num_ontologies):.2f}",
-            "avg_recall":    f"{(global_r / num_ontologies):.2f}",
-            "avg_f1":        f"{(global_f1 / num_ontologies):.2f}",
-            "avg_onto_conf": f"{(global_onto_conf / num_ontologies):.2f}",
-            "avg_sub_halluc":f"{(global_sub_halluc / num_ontologies):.2f}",
-            "avg_rel_halluc":f"{(global_rel_halluc / num_ontologies):.2f}",
-            "avg_obj_halluc":f"{(global_obj_halluc / num_ontologies):.2f}",
-            "onto_list": eval_inputs.get('onto_list', [])
-        }
-        append_jsonl(global_metrics, eval_inputs['avg_out_file'])
-    else:
-        print("⚠️ Debug - 没有本体可计算全局指标")
+            logger.warning("⚠️ Debug - 没有本体可计算全局指标")
+
+    if eval_inputs.get('comparison_out_file'):
+        write_comparison_table(comparison_rows, eval_inputs['comparison_out_file'])
+
+    summary = {key: COUNTERS[key] for key in SUMMARY_COUNTERS}
+    summary.update(COUNTERS)
+    logger.info("📊 Summary: %s", ", ".join(f"{key}={value}" for key, value in summary.items()),
+                extra={"counters": summary})
 
 
 if __name__ == "__main__":